@@ -0,0 +1,78 @@
+# Measures the memory used by the parse tree of a large generated program, and the time taken to build it (with the
+# Python parser, and from the dicts that the Raku parser's output is loaded as), to look up children by symbol in every
+# node, and to compile the program. Usage: python benchmarks/node_benchmark.py [--functions N] [--repeat N]
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Directory of /serene/compiler/
+compiler_dir = Path(__file__).parent.resolve().parent
+sys.path.insert(0, str(compiler_dir))
+
+from src import compile, parser
+from src.common import Symbol
+from src.nodes import Node, NodeMap
+from suite import generate_functions
+
+
+def all_nodes(tree):
+    stack = [tree]
+    while stack:
+        x = stack.pop()
+        yield x
+        if isinstance(x.data, NodeMap):
+            stack.extend(x.data.data)
+
+def look_up_children(nodes):
+    # The same kinds of lookups as code generation: every symbol that is present, and one that isn't
+    for x in nodes:
+        if not isinstance(x.data, NodeMap):
+            continue
+        for y in x:
+            _ = x[y.nodetype]
+            _ = y.nodetype in x
+            _ = x.count(y.nodetype)
+        _ = Symbol.match_block in x
+
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    arg_parser = argparse.ArgumentParser('Benchmark the memory and lookup speed of parse trees.')
+    arg_parser.add_argument('--functions', type=int, default=500, help='number of functions in the generated program (default: 500)')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark (default: 3)')
+    args = arg_parser.parse_args()
+
+    text = generate_functions(args.functions)
+
+    gc.collect()
+    tracemalloc.start()
+    tree = parser.parse_nodes(text)
+    tree_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    nodes = list(all_nodes(tree))
+    build_time = best_time(lambda: parser.parse_nodes(text), args.repeat)
+    dicts = parser.parse(text)
+    create_time = best_time(lambda: Node.create(dicts), args.repeat)
+    lookup_time = best_time(lambda: look_up_children(nodes), args.repeat)
+    compile_time = best_time(lambda: compile.main(parser.parse_nodes(text), include_path=compiler_dir), args.repeat)
+
+    print(f"{len(text.splitlines())} lines, {len(nodes)} nodes")
+    print(f"{'tree memory':<20}{tree_size / 1024 / 1024:>10.2f} MiB ({tree_size / len(nodes):.0f} bytes per node)")
+    print(f"{'build tree':<20}{build_time:>10.3f} s")
+    print(f"{'tree from dicts':<20}{create_time:>10.3f} s")
+    print(f"{'look up children':<20}{lookup_time:>10.3f} s")
+    print(f"{'compile':<20}{compile_time:>10.3f} s")
+
+if __name__ == '__main__':
+    main()
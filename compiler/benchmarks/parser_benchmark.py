@@ -0,0 +1,59 @@
+# Compares the speed of the Raku parser (one-shot and server mode) and the Python parser on the test programs and on a
+# large generated program. Usage: python benchmarks/parser_benchmark.py [--repeat N]
+
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Directory of /serene/compiler/
+compiler_dir = Path(__file__).parent.resolve().parent
+sys.path.insert(0, str(compiler_dir))
+
+from src import parser, parsing
+from src.common import SereneSyntaxError
+from suite import best_time, generate_functions
+
+
+def parse_all(parse, paths):
+    for path in paths:
+        try:
+            parse(path)
+        except SereneSyntaxError:
+            pass
+
+def main():
+    arg_parser = argparse.ArgumentParser('Benchmark the Raku and Python parsers.')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark (default: 3)')
+    arg_parser.add_argument('--lines', type=int, default=10_000, help='size of the generated program (default: 10000)')
+    args = arg_parser.parse_args()
+
+    parsing.use_cache = False
+    test_files = sorted((compiler_dir / 'tests').glob('*.sn'))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generated = Path(temp_dir) / 'generated.sn'
+        generated.write_text(generate_functions(args.lines // 7))
+
+        parsers = {
+            'python (dicts)': lambda path: parser.parse(path.read_text(encoding='utf-8')),
+            'python (nodes)': lambda path: parser.parse_nodes(path.read_text(encoding='utf-8')),
+        }
+        if shutil.which('raku') is not None:
+            parsers['raku (one-shot)'] = parsing.parse_once
+            parsers['raku (server)'] = parsing.servers.parse
+            parsing.servers.parse(generated)     # Starts the server before it is timed
+        else:
+            print("Raku is not installed, so only the Python parser is measured.")
+
+        print(f"{'parser':<18}{'tests/*.sn (s)':>18}{f'{args.lines} lines (s)':>20}")
+        for name, parse in parsers.items():
+            tests_time = best_time(lambda: parse_all(parse, test_files), args.repeat)
+            generated_time = best_time(lambda: parse_all(parse, [generated]), args.repeat)
+            print(f"{name:<18}{tests_time:>18.3f}{generated_time:>20.3f}")
+
+        parsing.servers.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+# Measures how long the compiler takes to compile programs to C++, and how long the executables that it generates take
+# to run. The results can be saved as JSON, and compared to a saved baseline, in which case the exit code is 1 if any
+# benchmark got slower by more than the tolerance. The exit code is also 1 if compiling a program again with the codegen
+# cache is not faster than compiling it without the cache.
+#
+# Usage: python benchmarks/suite.py [--compile-only | --runtime-only] [--repeat N] [--output FILE] [--baseline FILE]
+#                                   [--tolerance FRACTION] [--min-difference SECONDS] [--parser {raku,python}]
+#
+# For example, to check a change: run with '--output baseline.json' before the change, and with '--baseline
+# baseline.json' after it.
+
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Directory of /serene/compiler/
+compiler_dir = Path(__file__).parent.resolve().parent
+sys.path.insert(0, str(compiler_dir))
+
+from src import compile, driver, incremental, parsing
+from src.build import BuildConfig
+from src.cache import DiskCache
+from src.common import SereneError
+
+# Programs whose executables are timed, which each run for about half a second
+programs_dir = Path(__file__).parent.resolve() / 'programs'
+
+
+def generate_functions(n_functions):
+    # Many small functions, each calling the one before it
+    return ''.join(f"function f{i}(x: Int64) -> Int64 {{\n"
+                   f"    var y: Int64 = x * {i} + (x - 1) / 2\n"
+                   f"    if y > 10 {{\n"
+                   f"        set y = y - 10\n"
+                   f"    }}\n"
+                   f"    return {f'f{i - 1}(y)' if i > 0 else 'y'}\n"
+                   f"}}\n\n" for i in range(n_functions)) + f"function main() {{\n    print f{n_functions - 1}(1)\n}}\n"
+
+def generate_generics(n_functions):
+    # Generic functions that are each instantiated with three types
+    return ''.join(f"function show{i}(a: X, b: X) on (type X) {{\n"
+                   f"    print a, b\n"
+                   f"}}\n\n" for i in range(n_functions)) + \
+           "function main() {\n" + ''.join(f"    run show{i}({i}, 1)\n    run show{i}({i}.5, 1.5)\n    run show{i}(\"{i}\", \"1\")\n"
+                                           for i in range(n_functions)) + "}\n"
+
+def generate_structs(n_structs):
+    # Structs with methods, where each struct has a field of the type before it
+    return ''.join(f"type S{i} struct {{\n"
+                   f"    value: Int64{f',{chr(10)}    inner: S{i - 1}' if i > 0 else ''}\n"
+                   f"}} with\n"
+                   f"  ~ definitions {{\n"
+                   f"        method get() -> Int64 {{\n"
+                   f"            return value\n"
+                   f"        }}\n\n"
+                   f"        method add!(x: Int64) {{\n"
+                   f"            set value += x\n"
+                   f"        }}\n"
+                   f"    }}\n\n" for i in range(n_structs)) + \
+           "function main() {\n    var s = S0(1)\n    run s.add!(2)\n    print s.get()\n}\n"
+
+def generate_arithmetic(n_functions, depth):
+    # Long chains of arithmetic operators, nested in parentheses, in generic and non-generic functions
+    def chain(name):
+        code = name
+        for i in range(depth):
+            code = f"({code} {'+-*'[i % 3]} {name})"
+        return code
+    return ''.join(f"function a{i}(x: Int64) -> Int64 {{\n"
+                   f"    var y = {chain('x')}\n"
+                   f"    return y + {chain('y')}\n"
+                   f"}}\n\n"
+                   f"function g{i}(x: X) on (type X) -> X {{\n"
+                   f"    return {chain('x')}\n"
+                   f"}}\n\n" for i in range(n_functions)) + \
+           "function main() {\n" + ''.join(f"    print a{i}(1), g{i}(2), g{i}(2.5)\n" for i in range(n_functions)) + "}\n"
+
+generated_programs = {
+    'functions_500': lambda: generate_functions(500),
+    'generics_300': lambda: generate_generics(300),
+    'structs_300': lambda: generate_structs(300),
+    'arithmetic_20x40': lambda: generate_arithmetic(20, 40),
+}
+
+def best_time(function, repeat):
+    # Best time out of several runs, so that the results are not skewed by other processes
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def compile_benchmarks(paths, repeat):
+    # Time to parse and compile each program to C++, without any caches. Programs with errors are included, since
+    # finding the error is part of the compiler's work too.
+    def compile_file(path):
+        try:
+            compile.compile_program(parsing.parse_file(path), include_path=path.parent, source_path=path).to_code()
+        except SereneError:
+            pass
+    return {path.stem: best_time(lambda: compile_file(path), repeat) for path in paths}
+
+def warm_compile_benchmarks(paths, repeat, cache_dir):
+    # Time to compile each program again with the codegen cache, after a first compile has filled it
+    incremental.use_cache = True
+    incremental.codegen_cache = DiskCache(cache_dir, max_size=incremental.codegen_cache.max_size, suffix='.json')
+    try:
+        results = {}
+        for path in paths:
+            compile_benchmarks([path], 1)
+            results.update(compile_benchmarks([path], repeat))
+        return results
+    finally:
+        incremental.use_cache = False
+
+def runtime_benchmarks(paths, repeat, build_dir):
+    # Time to run each program's executable, built in release mode. Programs with errors are skipped.
+    results = {}
+    for path in paths:
+        try:
+            executable = driver.build_executable(driver.compile_to_cpp(path), build_dir / path.stem, BuildConfig('release'))
+        except (SereneError, driver.SereneBuildError):
+            continue
+        results[path.stem] = best_time(lambda: subprocess.run([executable], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=True), repeat)
+    return results
+
+def compare(results, baseline, tolerance, min_difference):
+    # Prints the change of each benchmark compared to the baseline, and returns the names of the ones that regressed.
+    # Differences smaller than min_difference seconds are ignored, since they are mostly noise for the fastest benchmarks.
+    regressions = []
+    print(f"{'benchmark':<32}{'baseline (s)':>14}{'current (s)':>14}{'change':>10}")
+    for kind in ('compile', 'warm_compile', 'runtime'):
+        for name, seconds in results.get(kind, {}).items():
+            baseline_seconds = baseline.get(kind, {}).get(name)
+            if baseline_seconds is None:
+                continue
+            change = seconds / baseline_seconds - 1
+            regressed = change > tolerance and seconds - baseline_seconds > min_difference
+            if regressed:
+                regressions.append(f"{kind}/{name}")
+            print(f"{f'{kind}/{name}':<32}{baseline_seconds:>14.4f}{seconds:>14.4f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser('Benchmark compile times and the speed of generated code.')
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--compile-only', help='only measure compile times', action='store_true')
+    group.add_argument('--runtime-only', help='only measure the speed of generated code', action='store_true')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='number of runs of each benchmark (default: 5)')
+    arg_parser.add_argument('--output', type=str, metavar='FILE', help='save the results as JSON to FILE')
+    arg_parser.add_argument('--baseline', type=str, metavar='FILE', help='compare the results to those saved in FILE, and fail if any benchmark regressed')
+    arg_parser.add_argument('--tolerance', type=float, default=0.1, metavar='FRACTION', help='how much slower than the baseline a benchmark can be before it counts as a regression (default: 0.1)')
+    arg_parser.add_argument('--min-difference', type=float, default=0.005, metavar='SECONDS', help='smallest slowdown that counts as a regression (default: 0.005)')
+    arg_parser.add_argument('--parser', choices=['raku', 'python'], default='python', help='parser implementation to use (default: python)')
+    args = arg_parser.parse_args()
+
+    if args.parser == 'raku' and shutil.which('raku') is None:
+        arg_parser.error("Raku must be installed, unless the --parser=python option is used.")
+    baseline = None
+    if args.baseline is not None:
+        try:
+            baseline = json.loads(Path(args.baseline).read_text())
+        except (OSError, ValueError) as exc:
+            arg_parser.error(f"Invalid baseline file: {exc}")
+
+    parsing.backend = args.parser
+    parsing.use_cache = False
+    incremental.use_cache = False
+    driver.use_binary_cache = False
+
+    results = {'python': platform.python_version(), 'parser': args.parser}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        generated_paths = []
+        for name, generate in generated_programs.items():
+            generated_paths.append(temp_dir / f"{name}.sn")
+            generated_paths[-1].write_text(generate())
+
+        if not args.runtime_only:
+            test_paths = sorted((compiler_dir / 'tests').glob('p*.sn'), key=lambda path: int(path.stem[1:]))
+            results['compile'] = compile_benchmarks(test_paths + sorted(programs_dir.glob('*.sn')) + generated_paths, args.repeat)
+            results['warm_compile'] = warm_compile_benchmarks(generated_paths, args.repeat, temp_dir / 'codegen')
+        if not args.compile_only:
+            results['runtime'] = runtime_benchmarks(sorted(programs_dir.glob('*.sn')), args.repeat, temp_dir)
+    parsing.servers.stop()
+
+    for kind in ('compile', 'warm_compile', 'runtime'):
+        for name, seconds in results.get(kind, {}).items():
+            print(f"{f'{kind}/{name}':<32}{seconds:>14.4f} s")
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=4) + '\n')
+        print("Saved results to file", Path(args.output).resolve())
+
+    # The codegen cache is on by default, so it must make compiling a program again faster than compiling it without it
+    slower_with_cache = [name for name, seconds in results.get('warm_compile', {}).items() if seconds >= results['compile'][name]]
+    if slower_with_cache:
+        print()
+        print(f"Compiling with a warm codegen cache is not faster than without it: {', '.join(slower_with_cache)}")
+        exit(1)
+
+    if baseline is not None:
+        print()
+        regressions = compare(results, baseline, args.tolerance, args.min_difference)
+        if regressions:
+            print()
+            print(f"{len(regressions)} benchmark{'s' if len(regressions) != 1 else ''} regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            exit(1)
+        print()
+        print("No regressions.")
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,115 @@
+# Compiles each test program with the serene script, several at a time, and reports which ones failed and how long each
+# one took. Usage: python run_tests.py [PATTERN ...] [-j JOBS] [--coverage] [--slowest N] [--junit FILE] [--json FILE]
+# Any options that aren't recognized (such as --parser=python) are passed on to the serene script.
+
+import argparse
+import json
+import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from xml.etree import ElementTree
 from natsort import os_sorted
 from colorama import Fore, Style, init as init_colorama
 
 # Directory of this file ( /serene/compiler/ )
 here = Path(__file__).parent.resolve()
 
-init_colorama()
 
-existing_coverage = False
+class TestResult:
+    def __init__(self, path: Path, exit_code: int, stderr: str, seconds: float):
+        self.path = path
+        self.exit_code = exit_code
+        self.stderr = stderr
+        self.seconds = seconds
+
+def run_test(path: Path, output_dir: Path, serene_args: list[str], coverage: bool) -> TestResult:
+    # Each test writes its executable to its own file, so tests that run at the same time don't overwrite each other
+    command = ['coverage', 'run', '--parallel-mode'] if coverage else [sys.executable]
+    command += ['serene', str(path), '-o', str(output_dir / path.stem)] + serene_args
+    start = time.perf_counter()
+    completed_process = subprocess.run(command, cwd=here, capture_output=True, text=True)
+    return TestResult(path, completed_process.returncode, completed_process.stderr, time.perf_counter() - start)
+
+def write_junit(results: list[TestResult], report_path: Path):
+    suite = ElementTree.Element('testsuite', name='serene', tests=str(len(results)),
+                                failures=str(sum(1 for x in results if x.exit_code != 0)),
+                                time=f"{sum(x.seconds for x in results):.3f}")
+    for x in results:
+        case = ElementTree.SubElement(suite, 'testcase', classname='tests', name=x.path.name, time=f"{x.seconds:.3f}")
+        if x.exit_code != 0:
+            failure = ElementTree.SubElement(case, 'failure', message=f"Failed with error code {x.exit_code}.")
+            failure.text = x.stderr
+    ElementTree.ElementTree(suite).write(report_path, encoding='utf-8', xml_declaration=True)
+
+def write_json(results: list[TestResult], report_path: Path):
+    report = [{'name': x.path.name, 'exit_code': x.exit_code, 'seconds': round(x.seconds, 6), 'stderr': x.stderr} for x in results]
+    report_path.write_text(json.dumps(report, indent=4) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the Serene test programs.')
+    parser.add_argument('PATTERN', nargs='*', default=['tests/t*.sn'], help='glob patterns of test programs, relative to this directory (default: tests/t*.sn)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of tests compiled at the same time (default: number of CPUs)')
+    parser.add_argument('--coverage', help='run the compiler under coverage.py, and combine the data of all tests into .coverage', action='store_true')
+    parser.add_argument('--slowest', type=int, default=10, metavar='N', help='number of slowest tests to list (default: 10)')
+    parser.add_argument('--junit', type=str, metavar='FILE', help='write a JUnit XML report to FILE')
+    parser.add_argument('--json', type=str, metavar='FILE', help='write a JSON report to FILE')
+    args, serene_args = parser.parse_known_args()
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1.')
+    if args.coverage and shutil.which('coverage') is None:
+        parser.error('coverage.py must be installed to use --coverage.')
+
+    init_colorama()
 
-paths = os_sorted([Path(x) for x in here.glob("./tests/t*.sn")])
-for p in paths:
+    paths = os_sorted({path for pattern in args.PATTERN for path in here.glob(pattern)})
+    if len(paths) == 0:
+        print('No test programs found.')
+        return 1
+
+    if args.coverage:
+        subprocess.run(['coverage', 'erase'], cwd=here)
+
+    start = time.perf_counter()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='serene-tests-') as output_dir, ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        # Results are shown in order, as soon as each test and the ones before it have finished
+        futures = [executor.submit(run_test, path, Path(output_dir), serene_args, args.coverage) for path in paths]
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            print()
+            print(f"Testing {result.path.name} ({result.seconds:.2f} s)")
+            if result.exit_code == 0:
+                print(f"{Fore.GREEN}> Success!{Style.RESET_ALL}")
+            else:
+                print(f"{Fore.YELLOW}{result.stderr}{Style.RESET_ALL}")
+                print(f"{Fore.RED}{Style.BRIGHT}> Failed with error code {result.exit_code}.{Style.RESET_ALL}")
+    total_seconds = time.perf_counter() - start
+
+    if args.coverage:
+        subprocess.run(['coverage', 'combine'], cwd=here, capture_output=True)
+
+    if args.slowest > 0:
+        print()
+        print(f"Slowest {min(args.slowest, len(results))} tests:")
+        for x in sorted(results, key=lambda x: x.seconds, reverse=True)[:args.slowest]:
+            print(f"    {x.seconds:8.2f} s  {x.path.name}")
+
+    if args.junit is not None:
+        write_junit(results, Path(args.junit))
+    if args.json is not None:
+        write_json(results, Path(args.json))
+
+    n_failed = sum(1 for x in results if x.exit_code != 0)
     print()
-    print('Testing', p.name, 'now...')
-    if not existing_coverage:
-        serene_completed_process = subprocess.run(['coverage', 'run', 'serene', p, '-o', './temp/test_compiled'], cwd=here, capture_output=True, text=True)
-        existing_coverage = True
-    else:
-        serene_completed_process = subprocess.run(['coverage', 'run', '--append', 'serene', p, '-o', './temp/test_compiled'], cwd=here, capture_output=True, text=True)
-    if serene_completed_process.returncode == 0:
-        print(f"{Fore.GREEN}> Success!{Style.RESET_ALL}")
-    else:
-        print(f"{Fore.YELLOW}{serene_completed_process.stderr}{Style.RESET_ALL}")
-        print(f"{Fore.RED}{Style.BRIGHT}> Failed with error code {serene_completed_process.returncode}.{Style.RESET_ALL}")
+    print(f"{len(results) - n_failed} succeeded, {n_failed} failed in {total_seconds:.2f} s.")
+    return 1 if n_failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
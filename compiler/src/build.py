@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import os
+import shlex
+import subprocess
+import tempfile
+from pathlib import Path
+
+from src.common import *
+from src.cache import DiskCache, hash_bytes
+
+# Directory of the runtime headers, /serene/compiler/src/lib/
+lib_dir = Path(__file__).parent.resolve() / 'lib'
+
+# Settings for compiling the generated C++ code with g++. The runtime's bounds checks call exit() directly rather than
+# using assert(), so -DNDEBUG does not remove any checks from Serene programs.
+
+profiles = {
+    'debug':   ['-O0'],
+    'release': ['-O2', '-flto', '-DNDEBUG'],
+    'native':  ['-O3', '-march=native', '-flto', '-DNDEBUG'],    # The executable may not run on other CPUs
+}
+
+optimization_levels = ('0', '1', '2', '3', 's', 'fast', 'g')
+
+# Large programs are split into several translation units, which are compiled in parallel by up to 'jobs' g++
+# processes. Each unit pays for parsing the headers again, so there is one unit per min_unit_size characters of
+# function code at most.
+min_unit_size = 20_000
+
+
+class BuildConfig:
+    def __init__(self, profile: str = 'debug', optimization: str | None = None, extra_flags: list[str] | None = None, jobs: int | None = None,
+                 pgo_command: str | None = None):
+        if profile not in profiles:
+            raise ValueError(profile)
+        self.profile = profile
+        self.optimization = optimization      # Overrides the optimization level of the profile, e.g. '3' for -O3
+        self.extra_flags = extra_flags if extra_flags is not None else []
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+        self.pgo_command = pgo_command        # Training command for a profile-guided optimization build (see pgo.py)
+
+    def flags(self) -> list[str]:
+        # Later flags take precedence in g++, so the extra flags can override anything set by the profile
+        flags = ['-std=c++17', '-I', str(lib_dir)] + profiles[self.profile]
+        if self.optimization is not None:
+            flags.append('-O' + self.optimization)
+        flags.extend(self.extra_flags)
+        return flags
+
+    def unit_count(self, function_code_size: int) -> int:
+        return max(1, min(self.jobs, function_code_size // min_unit_size))
+
+    @staticmethod
+    def from_args(args) -> BuildConfig:
+        # Reads the options added by add_arguments. PGO builds are optimized by default, since profile data makes no
+        # difference at -O0.
+        if args.release:
+            profile = 'release'
+        elif args.build_profile is not None:
+            profile = args.build_profile
+        else:
+            profile = 'release' if args.pgo is not None else 'debug'
+        extra_flags = [flag for x in args.cxx_flags for flag in shlex.split(x)]
+        return BuildConfig(profile, args.optimization, extra_flags, args.jobs, args.pgo)
+
+
+# Generated programs include the whole runtime through serene_runtime.hh, which is precompiled once for each set of
+# flags. The precompiled headers are kept in pch_dir, which is searched before lib_dir when the program is compiled. g++
+# looks there for a directory named after the header, and uses the first file in it that was compiled with compatible
+# flags, so the precompiled headers for different configurations can live side by side. g++ does not check whether the
+# headers have changed since they were precompiled, so the file names start with a hash of the headers, and precompiled
+# headers for older versions of the headers are deleted.
+use_pch = True
+runtime_header = lib_dir / 'serene_runtime.hh'
+pch_dir = lib_dir / 'pch'
+pch_cache = DiskCache(pch_dir / 'serene_runtime.hh.gch', 512 * 1024 * 1024, '.gch')
+
+def headers_hash() -> str:
+    paths = sorted(x for x in lib_dir.iterdir() if x.suffix in ('.hh', '.hpp'))
+    return hash_bytes(*(part for x in paths for part in (x.name.encode(), x.read_bytes())))
+
+gxx_version = None
+
+def get_gxx_version() -> str:
+    global gxx_version
+    if gxx_version is None:
+        gxx_version = subprocess.run(['g++', '--version'], capture_output=True, text=True).stdout
+    return gxx_version
+
+def precompile_header(config: BuildConfig) -> list[str]:
+    # Builds the precompiled header for this configuration if it doesn't exist yet, and returns the flags that make g++
+    # use it. If it can't be built, no flags are returned, and the program is compiled with the plain headers instead.
+    if not use_pch:
+        return []
+    headers_key = headers_hash()[:16]
+    key = headers_key + '-' + hash_bytes(get_gxx_version().encode(), '\0'.join(config.flags()).encode())[:16]
+    pch_path = pch_cache.path_for(key)
+    if pch_path.is_file():
+        try:
+            os.utime(pch_path)
+        except OSError:
+            pass
+        return ['-I', str(pch_dir)]
+
+    try:
+        pch_cache.directory.mkdir(parents=True, exist_ok=True)
+        for x in pch_cache.directory.iterdir():
+            # Files starting with '.tmp-' may be headers that another process is still writing
+            if not x.name.startswith((headers_key, '.tmp-')):
+                try:
+                    x.unlink()
+                except OSError:
+                    pass
+        # Compiled outside of the directory, since g++ could otherwise try to read it while it is being written
+        fd, temp_name = tempfile.mkstemp(dir=pch_dir, prefix='.tmp-', suffix='.gch')
+        os.close(fd)
+    except OSError:
+        return []
+    completed_process = subprocess.run(['g++'] + config.flags() + ['-x', 'c++-header', str(runtime_header), '-o', temp_name])
+    if completed_process.returncode != 0:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        printerr("Could not build the precompiled header; compiling without it.")
+        return []
+    try:
+        os.replace(temp_name, pch_path)
+    except OSError:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        return []
+    pch_cache.evict()
+    return ['-I', str(pch_dir)]
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('C++ build options')
+    group.add_argument('--build-profile', choices=list(profiles), help='g++ flags to use: debug (-O0), release (-O2, LTO), or native (-O3, -march=native, LTO) (default: debug, or release with --pgo)')
+    group.add_argument('--release', help='same as --build-profile=release', action='store_true')
+    group.add_argument('-O', dest='optimization', choices=optimization_levels, help='g++ optimization level, which overrides the one from the build profile')
+    group.add_argument('-j', '--jobs', type=int, metavar='N', help='number of g++ processes to run at once when a large program is split into several translation units (default: number of CPUs)')
+    group.add_argument('--pgo', type=str, nargs='?', const='{binary}', metavar='COMMAND', help='profile-guided optimization: build an instrumented executable, run COMMAND in a shell with {binary} replaced by its path (or run it with COMMAND as arguments), and build again using the profile data, which is also used by later builds of the same code (default COMMAND: run the executable with no arguments)')
+    group.add_argument('--no-build-cache', help='always run g++, instead of reusing a cached executable built from the same C++ code', action='store_true')
+    group.add_argument('--no-pch', help="don't use a precompiled header for the Serene runtime", action='store_true')
+    group.add_argument('--cxx-flags', type=str, action='append', default=[], metavar='FLAGS', help='extra flags to pass to g++, e.g. --cxx-flags="-Wall -g" (can be repeated)')
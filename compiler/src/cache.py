@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+
+def hash_bytes(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        # Length prefix, so that different splits of the same bytes don't collide
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    # Content-addressed cache, stored as one file per key in a directory. Entries are never modified after they are
+    # written, so a key must include everything that the value depends on. The modification time of an entry is updated
+    # whenever it is read, and when the total size exceeds max_size, the least recently used entries are deleted.
+    def __init__(self, directory: Path, max_size: int, suffix: str = ''):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.suffix = suffix
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / (key + self.suffix)
+
+    def get(self, key: str) -> bytes | None:
+        path = self.path_for(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes, evict: bool = True):
+        # Callers that write many entries at once can pass evict=False, and call evict() once afterwards
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Written to a temporary file first, so that concurrent readers never see a partially written entry
+            fd, temp_name = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_name, self.path_for(key))
+        except OSError:
+            # The cache is only an optimization, so failing to write to it is not an error
+            return
+        if evict:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        try:
+            for path in self.directory.iterdir():
+                if path.name.startswith('.tmp-') or not path.name.endswith(self.suffix):
+                    continue
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            total_size -= size
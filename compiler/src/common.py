@@ -7,15 +7,29 @@ import enum
 def printerr(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
-class SereneScopeError(Exception):
+# Base class for all errors in the Serene program being compiled, which are reported to the user rather than being
+# treated as bugs in the compiler
+class SereneError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
 
-class SereneTypeError(Exception):
-    def __init__(self, message):
-        self.message = message
-        super().__init__(self.message)
+    def report(self) -> str:
+        return "COMPILE ERROR:\n" + self.message + "\n"
+
+class SereneScopeError(SereneError):
+    pass
+
+class SereneTypeError(SereneError):
+    pass
+
+class SereneSyntaxError(SereneError):
+    # The message is already formatted by the parser, including the "COMPILE ERROR:" header
+    def report(self) -> str:
+        return self.message
+
+class SereneCompileError(SereneError):
+    pass
 
 @enum.unique
 class Symbol(enum.Enum):
@@ -90,3 +104,7 @@ class Symbol(enum.Enum):
     else_branch = enum.auto()
     match_block = enum.auto()
     match_branch = enum.auto()
+
+    # Symbols are used as dictionary keys all the time (such as in the index of each NodeMap), and each member is a
+    # single object, so they are hashed by identity instead of by Enum's default hash of the name
+    __hash__ = object.__hash__
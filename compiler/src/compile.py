@@ -1,70 +1,184 @@
-import yaml
+from __future__ import annotations
+
 import textwrap
 import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-import subprocess
 
 from src.common import *
-from src.nodes import Node, StructDefinitionNode
-from src import scope, typecheck
+from src.nodes import NodeMap, StructDefinitionNode
+from src import scope, typecheck, parsing, timing, incremental
 
 
-def parse_additional(filename, include_path):
-    # Directory of /serene/compiler/
-    compiler_dir = Path(__file__).parent.resolve().parent
+class CppProgram:
+    # The generated C++ code for a program, kept in pieces so that it can either be written as a single file, or split
+    # into a shared header and several translation units that are compiled separately. The forward declarations and
+    # the function definitions are in the same order.
+    def __init__(self, struct_definitions: list[str], forward_declarations: list[str], functions: list[str]):
+        self.struct_definitions = struct_definitions
+        self.forward_declarations = forward_declarations
+        self.functions = functions
 
-    # Run Raku-based parser
-    source_path = (include_path / Path(filename)).resolve()
-    if source_path.is_file():
-        completed_process = subprocess.run(['raku', 'src/parser.raku', source_path], cwd=compiler_dir, capture_output=True, text=True)
-        printerr(completed_process.stderr, end='')
-    else:
-        printerr("Included file", filename, "does not exist.")
-        exit(1)
+    runtime_include = '#include "serene_runtime.hh"\n\n'
 
-    if completed_process.returncode == 0:
-        return completed_process.stdout
-    else:
-        exit(1)
+    main_function = textwrap.dedent("""\
+                                    int main() {
+                                        std::cout.imbue(std::locale(std::locale(), new SereneLocale));
+                                        std::cout.setf(std::ios::boolalpha);
+                                        sn_main();
+                                        return 0;
+                                    }
+                                    """)    # std::locale is implicitly reference-counted, so "new" is not an issue
 
-def main(my_yaml, include_path):
-    try:
-        tree = yaml.safe_load(my_yaml)[0]
-    except yaml.YAMLError as e:
-        printerr(e)
-        exit(1)
-    
-    # Parse include statements and add to tree
-    i = 0
-    while i < len(tree['definitions']):
-        x = tree['definitions'][i]
-        if list(x.keys())[0] != 'include_statement':
-            i += 1
-            continue
-        included_yaml = parse_additional(x['include_statement'][0]['file_name'], include_path)
-        try:
-            included_tree = yaml.safe_load(included_yaml)[0]
-        except yaml.YAMLError as e:
-            printerr(e)
-            exit(1)
-        
-        tree['definitions'].pop(i)
-        tree['definitions'].extend(included_tree['definitions'])
-
-    scope.definitions = Node.create(tree)
+    def declarations(self) -> str:
+        code = ''
+        code += ('\n\n'.join(self.struct_definitions)  + '\n\n') if len(self.struct_definitions) > 0 else ''
+        code += ('\n'.join(self.forward_declarations) + '\n\n') if len(self.forward_declarations) > 0 else ''
+        return code
+
+    def to_code(self) -> str:
+        code = self.runtime_include + self.declarations()
+        code += ('\n\n'.join(self.functions) + '\n\n') if len(self.functions) > 0 else ''
+        code += self.main_function
+        return code
+
+    def function_code_size(self) -> int:
+        return sum(len(x) for x in self.functions)
+
+    def header(self) -> str:
+        # The header doesn't include the runtime itself, since it is only included by units that already include the runtime. (When a
+        # precompiled header is used, g++ can't include the runtime header a second time.)
+        return '#pragma once\n\n' + self.declarations()
+
+    def to_units(self, n_units: int, header_name: str) -> list[str]:
+        # Splits the function definitions into at most n_units source files, which include the header. Each function is
+        # assigned to a unit by a hash of its declaration, so that editing one function only changes its own unit. (The
+        # runtime header is included first in each unit, since a precompiled header can't be used after other code.)
+        groups = [[] for _ in range(n_units)]
+        for declaration, code in zip(self.forward_declarations, self.functions):
+            groups[zlib.crc32(declaration.encode()) % n_units].append(code)
+
+        units = []
+        for i, group in enumerate(groups):
+            if len(group) == 0 and i != 0:
+                continue
+            code = self.runtime_include + f'#include "{header_name}"\n\n'
+            code += ('\n\n'.join(group) + '\n\n') if len(group) > 0 else ''
+            if i == 0:
+                code += self.main_function
+            units.append(code)
+        return units
+
+
+def included_files(definitions, include_path):
+    # Yields the (canonical path, file name as written) of each file included by a 'definitions' node
+    for x in definitions:
+        if x.nodetype == Symbol.include_statement:
+            filename = x[Symbol.file_name].data
+            yield (include_path / Path(filename)).resolve(), filename
+
+def resolve_includes(tree, include_path, source_path=None):
+    # Builds the graph of included files, starting from the main file. Each unique file is parsed only once, and as soon
+    # as a file has been parsed, the files that it includes are submitted to the thread pool, so that independent files
+    # are parsed in parallel. The definitions of all files are then concatenated in breadth-first order.
+    seen = {source_path} if source_path is not None else set()
+    trees = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=parsing.max_workers) as executor:
+        pending = {}
+
+        def submit(definitions):
+            for path, filename in included_files(definitions, include_path):
+                if path in seen:
+                    continue
+                seen.add(path)
+                if path.is_file():
+                    pending[executor.submit(timing.propagate(parsing.parse_file), path)] = path
+                else:
+                    errors[path] = SereneCompileError(f"Included file {filename} does not exist.")
+
+        submit(tree)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    trees[path] = future.result()
+                except SereneError as exc:
+                    errors[path] = exc
+                else:
+                    submit(trees[path])
+
+    definitions = []
+    queue = deque([tree])
+    added = {source_path} if source_path is not None else set()
+    while queue:
+        current = queue.popleft()
+        for x in current:
+            if x.nodetype != Symbol.include_statement:
+                definitions.append(x)
+        for path, _ in included_files(current, include_path):
+            if path in added:
+                continue
+            added.add(path)
+            if path in errors:
+                raise errors[path]
+            queue.append(trees[path])
+
+    tree.data = NodeMap(definitions)
+
+class CompileOptions:
+    # Settings of a compilation, from command line options. They are copied to the CompilationContext, so compilations
+    # that run at the same time can use different settings.
+    def __init__(self, max_instantiations: int | None = None, report_instantiations: bool = False):
+        self.max_instantiations = max_instantiations        # Largest number of instantiations of one generic function
+        self.report_instantiations = report_instantiations  # Print the number of instantiations of each generic function
+
+def instantiation_report(counts, source_path=None):
+    # Generic functions with the most instantiations first
+    rows = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    width = max([40] + [len(name) + 2 for name in counts])
+    lines = [f"Generic instantiations{f' in {source_path.name}' if source_path is not None else ''}:",
+             f"{'Function':<{width}}{'Count':>8}"]
+    lines += [f"{name:<{width}}{count:>8}" for name, count in rows]
+    lines.append(f"Total: {sum(counts.values())} instantiations of {len(counts)} generic functions")
+    return '\n'.join(lines) + '\n'
+
+def main(tree, include_path, source_path=None, context=None, options=None):
+    # Compiles the parse tree of a program to C++ code, and raises SereneError if the program is invalid. Each call uses
+    # a new CompilationContext (unless one is passed in), so this can be called any number of times in the same process,
+    # including concurrently on different threads.
+    return compile_program(tree, include_path, source_path, context, options).to_code()
+
+def compile_program(tree, include_path, source_path=None, context=None, options=None):
+    # Same as main, but returns a CppProgram instead of a single C++ file. The options are used for the new context,
+    # if no context is passed in.
+    if context is None:
+        context = scope.CompilationContext(options)
+    with scope.use_context(context):
+        return generate_code(tree, include_path, source_path)
+
+def generate_code(tree, include_path, source_path):
+    with timing.phase('include resolution'):
+        resolve_includes(tree, include_path, source_path)
+
+    scope.definitions = tree
     scope.functions = []
     struct_definitions = []
     for x in scope.definitions:
         if x.nodetype == Symbol.function:
             if x[Symbol.identifier].data in scope.function_names:
-                printerr("COMPILE ERROR:", f"Function '{x[Symbol.identifier].data}' has more than one definition.", sep="\n")
-                exit(1)
+                raise SereneScopeError(f"Function '{x[Symbol.identifier].data}' has more than one definition.")
             else:
                 scope.functions.append(x)
                 scope.function_names.append(x[Symbol.identifier].data)
+                scope.functions_by_name[x[Symbol.identifier].data] = x
         elif x.nodetype == Symbol.struct_definition:
             struct_name = x.get_scalar(Symbol.base_type)
-            if (struct_name in typecheck.user_defined_types) or (struct_name in typecheck.standard_types):
+            if (struct_name in scope.user_defined_types) or (struct_name in typecheck.standard_types):
                 raise SereneTypeError(f"Found duplicate type definition for type '{struct_name}'.")
             else:
                 struct_definitions.append(x)
@@ -72,66 +186,71 @@ def main(my_yaml, include_path):
             raise NotImplementedError(x.nodetype)
     
     try:
-        for x in struct_definitions:
-            struct_name = x.get_scalar(Symbol.base_type)
-            typecheck.user_defined_types[struct_name] = x.get_type_spec()
-        for x in struct_definitions:
-            struct_name = x.get_scalar(Symbol.base_type)
-            x.process_methods(typespec=typecheck.user_defined_types[struct_name])
-    except (SereneScopeError, SereneTypeError) as exc:
-        printerr("COMPILE ERROR:", exc.message, sep="\n")
-        exit(1)
+        with timing.phase('struct processing'):
+            for x in struct_definitions:
+                struct_name = x.get_scalar(Symbol.base_type)
+                scope.user_defined_types[struct_name] = x.get_type_spec()
+            for x in struct_definitions:
+                struct_name = x.get_scalar(Symbol.base_type)
+                x.process_methods(typespec=scope.user_defined_types[struct_name])
+    except SereneError:
+        raise
     except Exception as exc:
         printerr(f"At struct definition for '{x.get_scalar(Symbol.base_type)}':")
         raise exc
 
-    try:
+    with timing.phase('topological ordering'):
         sorted_structs = StructDefinitionNode.topological_ordering()
-    except (SereneTypeError) as exc:
-        printerr("COMPILE ERROR:", exc.message, sep="\n")
-        exit(1)
-    
     struct_definitions.sort(key=lambda x: sorted_structs.index(x.get_scalar(Symbol.base_type)), reverse=True)
 
 
     if 'main' not in scope.function_names:
-        printerr("COMPILE ERROR:", "No 'main()' function is defined.", sep="\n")
-        exit(1)
+        raise SereneCompileError("No 'main()' function is defined.")
+
+    keys = incremental.KeyBuilder(scope.functions, struct_definitions) if incremental.enabled() else None
+    incremental.start()
 
     function_code = []
     function_forward_declarations = []
     try:
-        for x in scope.functions:
-            x.setup()
-            if not x.generic:
-                function_forward_declarations.append(x.to_forward_declaration())
+        with timing.phase('FunctionNode.setup'):
+            for x in scope.functions:
+                x.setup()
 
-        for x in scope.functions:
-            if not x.generic:
-                function_code.append(x.to_code())
+        with timing.phase('function code generation'):
+            for x in scope.functions:
+                if not x.generic:
+                    with timing.phase(x[Symbol.identifier].data, 'function'):
+                        declaration, code = incremental.generate(keys.key(x) if keys else None, x.to_code, x.to_forward_declaration)
+                        function_forward_declarations.append(declaration)
+                        function_code.append(code)
 
-        i = 0
-        while i < len(scope.remaining_generic_functions):
-            cur = scope.remaining_generic_functions[i]
+        with timing.phase('generic instantiation'):
+            i = 0
+            while i < len(scope.remaining_generic_functions):
+                cur = scope.remaining_generic_functions[i]
 
-            original_function, generic_combos_params_temp, generic_combos_type_params_temp = cur
+                original_function, generic_combos_params_temp, generic_combos_type_params_temp = cur
 
-            original_function.my_scope.generic_combos_params_temp = generic_combos_params_temp
-            original_function.my_scope.generic_combos_type_params_temp = generic_combos_type_params_temp
-            scope.current_type_params = generic_combos_type_params_temp
+                original_function.my_scope.generic_combos_params_temp = generic_combos_params_temp
+                original_function.my_scope.generic_combos_type_params_temp = generic_combos_type_params_temp
+                scope.current_type_params = generic_combos_type_params_temp
 
-            original_function.reset_scope()
-            function_forward_declarations.append(original_function.to_forward_declaration())
-            function_code.append(original_function.to_code())
+                instantiation_name = f"{original_function[Symbol.identifier].data}({', '.join(str(x) for x in generic_combos_params_temp)})"
+                with timing.phase(instantiation_name, 'generic'):
+                    original_function.reset_scope()
+                    key = keys.key(original_function, generic_combos_params_temp, generic_combos_type_params_temp) if keys else None
+                    declaration, code = incremental.generate(key, original_function.to_code, original_function.to_forward_declaration)
+                    function_forward_declarations.append(declaration)
+                    function_code.append(code)
 
-            original_function.my_scope.generic_combos_params_temp = None
-            original_function.my_scope.generic_combos_type_params_temp = None
-            scope.current_type_params = None
-            i += 1
+                original_function.my_scope.generic_combos_params_temp = None
+                original_function.my_scope.generic_combos_type_params_temp = None
+                scope.current_type_params = None
+                i += 1
 
-    except (SereneScopeError, SereneTypeError) as exc:
-        printerr("COMPILE ERROR:", exc.message, sep="\n")
-        exit(1)
+    except SereneError:
+        raise
     except Exception as exc:
         printerr(f"At source line number {scope.line_number}:")
         raise exc
@@ -140,35 +259,19 @@ def main(my_yaml, include_path):
     struct_definition_code = []
 
     try:
-        for x in struct_definitions:
-            #struct_forward_declarations.append(x.to_forward_declaration())     # Not currently needed
-            struct_definition_code.append(x.to_code())
-    except (SereneScopeError, SereneTypeError) as exc:
-        printerr("COMPILE ERROR:", exc.message, sep="\n")
-        exit(1)
+        with timing.phase('struct code generation'):
+            for x in struct_definitions:
+                #struct_forward_declarations.append(x.to_forward_declaration())     # Not currently needed
+                with timing.phase(x.get_scalar(Symbol.base_type), 'struct'):
+                    struct_definition_code.append(incremental.generate(keys.key(x) if keys else None, x.to_code)[1])
+    except SereneError:
+        raise
     except Exception as exc:
         printerr(f"At struct definition for '{x.get_scalar(Symbol.base_type)}':")
         raise exc
 
-    code = textwrap.dedent("""\
-                           #include <iostream>
-                           #include <cstdint>
-                           #include "../src/lib/serene_printing.hh"
-                           #include "../src/lib/serene_array.hh"
-                           #include "../src/lib/serene_string.hh"
-                           #include "../src/lib/serene_vector.hh"
-                           #include "../src/lib/serene_file.hh"
-                           #include "../src/lib/serene_locale.hh"
-                           
-                           """)
-    #code += ('\n'.join(struct_forward_declarations)   + '\n\n') if len(struct_forward_declarations) > 0 else ''        #Not currently needed
-    code += ('\n\n'.join(struct_definition_code)      + '\n\n') if len(struct_definition_code) > 0 else ''
-    code += ('\n'.join(function_forward_declarations) + '\n\n') if len(function_forward_declarations) > 0 else ''
-    code += ('\n\n'.join(function_code)               + '\n\n') if len(function_code) > 0 else ''
-    code += "int main() {\n    "
-    code += "std::cout.imbue(std::locale(std::locale(), new SereneLocale));\n    "  # std::locale is implicitly reference-counted, so "new" is not an issue
-    code += "std::cout.setf(std::ios::boolalpha);\n    "
-    code += "sn_main();\n    "
-    code += "return 0;\n}\n"
-
-    return code
+    parsing.finish()
+    incremental.finish()
+    if scope.report_instantiations:
+        printerr(instantiation_report(scope.instantiation_counts(), source_path), end='')
+    return CppProgram(struct_definition_code, function_forward_declarations, function_code)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+
+from src.common import *
+from src import parsing, compile, timing, profiling, build, pgo, incremental
+from src.nodes import Node
+from src.build import BuildConfig
+from src.compile import CppProgram, CompileOptions
+from src.cache import DiskCache, hash_bytes
+
+# Directory of /serene/compiler/
+compiler_dir = Path(__file__).parent.resolve().parent
+
+# Executables built by g++ are cached by a hash of everything that they depend on, so rebuilding a program whose C++
+# code hasn't changed doesn't run g++ again. If use_binary_cache is False, the cache is neither read nor written.
+# Object files of translation units are cached in the same way.
+use_binary_cache = True
+binary_cache = DiskCache(parsing.cache_dir / 'binaries', max_size=256 * 1024 * 1024)
+object_cache = DiskCache(parsing.cache_dir / 'objects', max_size=256 * 1024 * 1024, suffix='.o')
+
+
+class SereneBuildError(Exception):
+    # Errors that are not caused by the Serene program itself, such as invalid output paths or g++ failures
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def expand_inputs(patterns: list[str]) -> list[Path]:
+    # Expands glob patterns (for shells that don't), keeping the order of the arguments and removing duplicates
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if len(matches) == 0:
+                raise SereneBuildError(f"No files match {pattern}.")
+        else:
+            matches = [pattern]
+        for x in matches:
+            path = Path(x).resolve()
+            if not path.is_file():
+                raise SereneBuildError(f"File {x} does not exist.")
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+def check_output_path(output: str | Path) -> Path:
+    output_path = Path('.') / Path(output)     # Path('.') is the directory where the program is run, not the directory of the program itself
+    if output_path.is_dir():
+        raise SereneBuildError('Invalid output file name.')
+    try:
+        output_path = output_path.parent.resolve(strict=True) / output_path.name
+    except FileNotFoundError:
+        raise SereneBuildError('Invalid output directory.')
+    if output_path.suffix != '':
+        raise SereneBuildError('Invalid output file name.')
+    return output_path
+
+def build_inputs(flags: list[str]) -> bytes:
+    # Everything other than the C++ code that affects what g++ produces
+    return '\0'.join(flags + [build.headers_hash(), build.get_gxx_version()]).encode()
+
+def compile_to_cpp(source_path: Path, tree: Node | None = None, options: CompileOptions | None = None) -> CppProgram:
+    # Parses a file (unless its tree is passed in) and its includes, and returns the generated C++ code. Raises
+    # SereneError if the program is invalid.
+    if tree is None:
+        tree = parsing.parse_file(source_path)
+    with profiling.profile(source_path.stem):
+        return compile.compile_program(tree, include_path=source_path.parent, source_path=source_path, options=options)
+
+def run_gxx(args: list[str], build_dir: Path):
+    # File names are relative to the build directory, which g++ is run in. (g++ includes the names of the source files in
+    # the checksums of profile data, which would otherwise differ between builds.)
+    completed_process = subprocess.run(['g++'] + args, cwd=build_dir)
+    if completed_process.returncode != 0:
+        raise SereneBuildError(f"g++ compiler failed with error code {completed_process.returncode}.")
+
+def binary_cache_key(cpp_code: str, config: BuildConfig, profile_hash: str | None) -> str:
+    return hash_bytes(cpp_code.encode(), build_inputs(config.flags()), (profile_hash or '').encode())
+
+def build_file(source_path: Path, output_path: Path, config: BuildConfig | None = None, options: CompileOptions | None = None) -> Path:
+    # Compiles a Serene file to an executable, running the stages that don't depend on each other at the same time: the
+    # precompiled header is built while the program is parsed and compiled to C++, and the files that it includes are
+    # parsed while the file itself is.
+    if config is None:
+        config = BuildConfig()
+    executor = ThreadPoolExecutor(max_workers=parsing.max_workers + 1)
+    try:
+        pch = executor.submit(timing.propagate(build.precompile_header), config)
+        with parsing.prefetch_includes(source_path, executor):
+            program = compile_to_cpp(source_path, options=options)
+        return build_executable(program, output_path, config, pch)
+    finally:
+        # If the program is invalid, the error is reported without waiting for the precompiled header
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def watch(source_path: Path, output_path: Path, config: BuildConfig | None = None, poll_interval: float = 0.2, max_builds: int | None = None,
+          options: CompileOptions | None = None):
+    # Builds the executable, and builds it again whenever the file or one of the files that it includes changes, until
+    # interrupted (or until max_builds builds have been done). Parse trees and generated code are kept in memory between
+    # builds, so only the files that changed are parsed again, and only the functions and structs that are affected by
+    # the change are compiled to C++ again.
+    parsing.tree_memo = {}
+    incremental.memo = incremental.CodegenMemo()
+    n_builds = 0
+    while True:
+        stamps = {source_path: parsing.file_stamp(source_path)}
+        try:
+            printerr("Saved output to file", build_file(source_path, output_path, config, options))
+            printerr(incremental.latest_stats().summary())
+        except SereneError as exc:
+            printerr(exc.report(), end='')
+        except SereneBuildError as exc:
+            printerr(exc.message)
+        n_builds += 1
+        if max_builds is not None and n_builds >= max_builds:
+            return
+
+        # Every file that has been parsed is watched, with the stamp that it had when it was parsed
+        stamps.update({path: entry[0] for path, entry in parsing.tree_memo.items()})
+        printerr(f"Watching {len(stamps)} file{'s' if len(stamps) != 1 else ''} for changes...")
+        while all(parsing.file_stamp(path) == stamp for path, stamp in stamps.items()):
+            time.sleep(poll_interval)
+        printerr()
+        printerr('Compiling', source_path, 'now...')
+
+def build_executable(program: CppProgram | str, output_path: Path, config: BuildConfig | None = None, pch: Future | None = None) -> Path:
+    # Compiles C++ code with g++, and returns the path of the executable. The output of g++ (such as warnings) is shown.
+    # Each build uses its own temporary directory, so that several builds can run at the same time. If the precompiled
+    # header is already being built, pch is its future.
+    if config is None:
+        config = BuildConfig()
+    if os.name == 'nt':
+        output_path = output_path.with_suffix('.exe')
+    cpp_code = program if isinstance(program, str) else program.to_code()
+    n_units = 1 if isinstance(program, str) else config.unit_count(program.function_code_size())
+
+    # Profile data saved by an earlier --pgo build of the same code with the same flags is used automatically
+    pgo_key = pgo.profile_key(cpp_code, build_inputs(config.flags()), n_units)
+    profile_hash = pgo.profile_hash(pgo_key) if config.pgo_command is None else None
+
+    if use_binary_cache and config.pgo_command is None:
+        with timing.phase('binary cache lookup'):
+            cached = binary_cache.get(binary_cache_key(cpp_code, config, profile_hash))
+        if cached is not None:
+            output_path.write_bytes(cached)
+            output_path.chmod(0o755)
+            return output_path
+
+    with tempfile.TemporaryDirectory(prefix='serene-build-') as build_dir:
+        build_dir = Path(build_dir)
+        with timing.phase('precompiled header'):
+            pch_flags = pch.result() if pch is not None else build.precompile_header(config)
+
+        if config.pgo_command is not None:
+            executable_path = compile_in(build_dir, program, n_units, config, pch_flags, ['-fprofile-generate'])
+            with timing.phase('PGO training'):
+                exit_code = pgo.train(config.pgo_command, executable_path)
+            if exit_code != 0:
+                raise SereneBuildError(f"PGO training command failed with error code {exit_code}.")
+            pgo.save_profile(pgo_key, build_dir)
+            profile_hash = pgo.profile_hash(pgo_key)
+            executable_path = compile_in(build_dir, program, n_units, config, pch_flags, ['-fprofile-use'])
+        elif profile_hash is not None:
+            pgo.restore_profile(pgo_key, build_dir)
+            executable_path = compile_in(build_dir, program, n_units, config, pch_flags, ['-fprofile-use'])
+        else:
+            executable_path = compile_in(build_dir, program, n_units, config, pch_flags, [])
+
+        if use_binary_cache:
+            binary_cache.put(binary_cache_key(cpp_code, config, profile_hash), executable_path.read_bytes())
+        shutil.copy2(executable_path, output_path)
+    return output_path
+
+def compile_in(build_dir: Path, program: CppProgram | str, n_units: int, config: BuildConfig, pch_flags: list[str], pgo_flags: list[str]) -> Path:
+    # Builds the executable in build_dir, and returns its path
+    executable_name = 'compiled.exe' if os.name == 'nt' else 'compiled'
+    flags = config.flags() + pgo_flags
+    if n_units == 1:
+        (build_dir / 'generated.cc').write_text(program if isinstance(program, str) else program.to_code())
+        with timing.phase('g++'):
+            run_gxx(pch_flags + flags + ['generated.cc', '-o', executable_name], build_dir)
+    else:
+        # Object files are not cached in PGO builds, since instrumented ones write their profile data to the directory
+        # where they were built, and the others depend on the profile data
+        object_names = compile_units(program, n_units, build_dir, flags, pch_flags, use_cache=use_binary_cache and len(pgo_flags) == 0)
+        with timing.phase('g++ (link)'):
+            run_gxx(flags + object_names + ['-o', executable_name], build_dir)
+    executable_path = build_dir / executable_name
+    if not executable_path.is_file():
+        raise SereneBuildError('Error compiling to temporary directory.')
+    return executable_path
+
+def compile_units(program: CppProgram, n_units: int, build_dir: Path, flags: list[str], pch_flags: list[str], use_cache: bool) -> list[str]:
+    # Compiles each translation unit to an object file in parallel, and returns their names. Object files are cached
+    # like executables, so units whose code hasn't changed are not compiled again.
+    header = program.header()
+    (build_dir / 'generated.hh').write_text(header)
+    units = program.to_units(n_units, 'generated.hh')
+    inputs = build_inputs(flags)
+
+    def compile_unit(i: int, unit_code: str) -> str:
+        object_name = f"generated_{i}.o"
+        key = hash_bytes(header.encode(), unit_code.encode(), inputs) if use_cache else None
+        if key is not None:
+            cached = object_cache.get(key)
+            if cached is not None:
+                (build_dir / object_name).write_bytes(cached)
+                return object_name
+
+        (build_dir / f"generated_{i}.cc").write_text(unit_code)
+        with timing.phase('g++ (translation unit)'):
+            run_gxx(pch_flags + flags + ['-c', f"generated_{i}.cc", '-o', object_name], build_dir)
+        if key is not None:
+            object_cache.put(key, (build_dir / object_name).read_bytes())
+        return object_name
+
+    with ThreadPoolExecutor(max_workers=n_units) as executor:
+        return list(executor.map(timing.propagate(compile_unit), range(len(units)), units))
+
+
+class BatchResult:
+    def __init__(self, source_path: Path, output_path: Path | None = None, exit_code: int = 0, message: str = ''):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.exit_code = exit_code
+        self.message = message
+
+def batch_output_paths(source_paths: list[Path], output_dir: Path) -> dict[Path, Path]:
+    # Each executable is named after its source file. Files with the same name in different directories would overwrite
+    # each other, so they are not allowed.
+    output_paths = {}
+    for path in source_paths:
+        output_path = output_dir / path.stem
+        if output_path in output_paths.values():
+            raise SereneBuildError(f"More than one input file would be saved to {output_path}.")
+        output_paths[path] = output_path
+    return output_paths
+
+def run_batch(source_paths: list[Path], output_dir: Path | None, parse_only: bool = False, config: BuildConfig | None = None,
+              options: CompileOptions | None = None) -> list[BatchResult]:
+    # Compiles each file in the same process, so that interpreter startup and parser warm-up are only paid once. If
+    # output_dir is None, the C++ code is generated but not compiled. Executables are built by up to config.jobs g++
+    # processes in the background, while the next files are compiled to C++. The status of each file is printed in order,
+    # as soon as it and the files before it have finished.
+    if config is None:
+        config = BuildConfig()
+    output_paths = batch_output_paths(source_paths, output_dir) if output_dir is not None else {}
+
+    results = []
+    builds = {}     # Index in results -> future of the executable's path
+    n_reported = 0
+
+    def report_finished(wait_for_builds: bool):
+        nonlocal n_reported
+        while n_reported < len(results):
+            result = results[n_reported]
+            build_future = builds.get(n_reported)
+            if build_future is not None:
+                if not wait_for_builds and not build_future.done():
+                    return
+                try:
+                    result.output_path = build_future.result()
+                except SereneBuildError as exc:
+                    result.exit_code = 1
+                    result.message = exc.message + '\n'
+
+            if result.exit_code == 0:
+                destination = f" -> {result.output_path}" if result.output_path is not None else ''
+                printerr(f"[ok]       {result.source_path}{destination}")
+            else:
+                printerr(f"[failed]   {result.source_path} (exit code {result.exit_code})")
+                printerr(textwrap.indent(result.message, '    '), end='')
+            n_reported += 1
+
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        pch = executor.submit(timing.propagate(build.precompile_header), config) if output_dir is not None else None
+        for source_path in source_paths:
+            result = BatchResult(source_path)
+            try:
+                if parse_only:
+                    parsing.parse_file(source_path)
+                else:
+                    program = compile_to_cpp(source_path, options=options)
+                    if output_dir is not None:
+                        builds[len(results)] = executor.submit(timing.propagate(build_executable), program, output_paths[source_path], config, pch)
+            except SereneError as exc:
+                result.exit_code = 1
+                result.message = exc.report()
+            results.append(result)
+            report_finished(wait_for_builds=False)
+        report_finished(wait_for_builds=True)
+    if parse_only:
+        parsing.finish()     # Compiling a program does this instead
+
+    n_failed = sum(1 for x in results if x.exit_code != 0)
+    printerr(f"{len(results) - n_failed} succeeded, {n_failed} failed.")
+    return results
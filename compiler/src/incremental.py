@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Iterator
+
+from src.common import *
+from src.cache import DiskCache, hash_bytes
+from src.nodes import Node, NodeMap, UnreachableError
+from src.typecheck import TypeObject
+from src import parsing, scope
+
+# Generated code for functions, generic instantiations, and structs is cached by a key that identifies everything that it
+# depends on, so that only the parts of a program that are affected by a change are compiled to C++ again. The cache is
+# kept on disk (in the same directory as the parse cache), so it is shared by all compilations and all programs; if
+# use_cache is False, it is neither read nor written. In watch mode, memo also keeps the entries of the previous
+# compilation in memory.
+#
+# The key of a function or struct is a hash of its own tree, of the signatures of the functions and structs that it
+# refers to by name (a function's signature is its tree without the body, and a struct's is its tree without the
+# method bodies), and of the compiler's own source code. Signatures are followed transitively, since the signature of a
+# called function can refer to structs that the caller doesn't name. Code generation doesn't look at the bodies of
+# other functions, so editing the body of a function only changes its own key, while editing its signature also changes
+# the keys of everything that refers to it. Line numbers are left out, since they only appear in error messages, and
+# code that caused an error is never cached.
+#
+# Generating the code for a call to a generic function also requests an instantiation of that function, so each entry
+# records the instantiations that were requested, and they are requested again when the entry is used.
+use_cache = True
+codegen_cache = DiskCache(parsing.cache_dir / 'codegen', max_size=64 * 1024 * 1024, suffix='.json')
+memo: CodegenMemo | None = None
+
+compiler_hash = None
+
+
+class CodegenStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def summary(self) -> str:
+        return f"Generated code for {self.misses} of {self.hits + self.misses} functions, instantiations, and structs."
+
+# Counts for the latest compilation on each thread
+local = threading.local()
+
+
+class CodegenMemo:
+    def __init__(self):
+        self.entries: dict[str, dict] = {}
+        self.used: set[str] = set()
+
+    def get(self, key: str) -> dict | None:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.used.add(key)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        self.entries[key] = entry
+        self.used.add(key)
+
+    def start(self):
+        self.used = set()
+
+    def finish(self):
+        # Entries that weren't used by the latest compilation are for code that no longer exists
+        self.entries = {k: v for k, v in self.entries.items() if k in self.used}
+
+
+symbol_names = {x: x.name for x in Symbol}
+
+def scan(node: Node) -> tuple[tuple[str, set[str]], tuple[str, set[str]]]:
+    # Returns a hash of the tree under node and the set of all scalar strings (such as identifiers and type names) in it,
+    # and the same for its signature, which leaves out the 'statements' subtrees. The tree is walked once, with an
+    # explicit stack, since it can be deeply nested.
+    parts = []
+    signature_parts = []
+    names = set()
+    signature_names = set()
+    close = object()
+    stack = [(node, True)]
+    while stack:
+        x, in_signature = stack.pop()
+        if x is close:
+            parts.append(')')
+            if in_signature:
+                signature_parts.append(')')
+            continue
+        if x.nodetype is Symbol.line_number:
+            continue
+        in_signature = in_signature and x.nodetype is not Symbol.statements
+        if isinstance(x.data, NodeMap):
+            part = '(' + symbol_names[x.nodetype]
+            stack.append((close, in_signature))
+            stack.extend([(y, in_signature) for y in reversed(x.data.data)])
+        else:
+            part = '\0' + symbol_names[x.nodetype] + '=' + repr(x.data)
+            if isinstance(x.data, str):
+                names.add(x.data)
+                if in_signature:
+                    signature_names.add(x.data)
+        parts.append(part)
+        if in_signature:
+            signature_parts.append(part)
+    return ((hashlib.sha256('\n'.join(parts).encode()).hexdigest(), names),
+            (hashlib.sha256('\n'.join(signature_parts).encode()).hexdigest(), signature_names))
+
+def get_compiler_hash() -> str:
+    # The generated code depends on every part of the compiler, so any change to its source code invalidates the cache
+    global compiler_hash
+    if compiler_hash is None:
+        source_dir = Path(__file__).parent
+        compiler_hash = hash_bytes(*(part for x in sorted(source_dir.rglob('*.py')) for part in (str(x.relative_to(source_dir)).encode(), x.read_bytes())))
+    return compiler_hash
+
+def enabled() -> bool:
+    return use_cache or memo is not None
+
+def start():
+    local.stats = CodegenStats()
+    if memo is not None:
+        memo.start()
+
+def latest_stats() -> CodegenStats:
+    return getattr(local, 'stats', CodegenStats())
+
+def finish():
+    if memo is not None:
+        memo.finish()
+    if use_cache:
+        codegen_cache.evict()
+
+
+class KeyBuilder:
+    # Computes the keys for one compilation
+    def __init__(self, functions: list[Node], structs: list[Node]):
+        self.signatures = {}
+        self.trees = {}     # Hash and names of the whole tree of each function and struct
+        for x in functions:
+            self.trees[x], self.signatures['function ' + x.get_scalar(Symbol.identifier)] = scan(x)
+        for x in structs:
+            self.trees[x], self.signatures['struct ' + x.get_scalar(Symbol.base_type)] = scan(x)
+        # Hash of each signature together with all of the signatures that it refers to, directly or through other
+        # signatures. Signatures can refer to each other, so the hash is shared by each group of signatures that refer to
+        # each other (a strongly connected component), and it includes the hashes of the groups that it refers to.
+        edges = {k: self.referenced(v[1]) for k, v in self.signatures.items()}
+        self.dependency_hashes = {}
+        for component in strongly_connected_components(edges):
+            parts = sorted(x + ' ' + self.signatures[x][0] for x in component)
+            parts += sorted({self.dependency_hashes[y] for x in component for y in edges[x] if y in self.dependency_hashes})
+            dependency_hash = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+            for x in component:
+                self.dependency_hashes[x] = dependency_hash
+
+    def referenced(self, names: set[str]) -> list[str]:
+        return [kind + name for name in names for kind in ('function ', 'struct ') if kind + name in self.signatures]
+
+    def key(self, node: Node, params: list[TypeObject] | None = None, type_params: dict[str, TypeObject] | None = None) -> str:
+        # For a generic instantiation, params and type_params are the types that the function is instantiated with
+        tree_hash, names = self.trees[node] if node in self.trees else scan(node)[0]
+        parts = [get_compiler_hash(), tree_hash]
+        if params is not None:
+            instantiation = [[type_to_json(x) for x in params], {k: type_to_json(v) for k, v in type_params.items()}]
+            parts.append(json.dumps(instantiation))
+            names = names | type_names(instantiation)
+
+        # Signatures of the functions and structs that are referred to, and of the ones that those signatures refer to
+        parts.extend(sorted({self.dependency_hashes[x] for x in self.referenced(names)}))
+
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def strongly_connected_components(edges: dict[str, list[str]]) -> Iterator[list[str]]:
+    # Tarjan's algorithm, without recursion. Each component is yielded after all of the components that it has edges to.
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    for root in edges:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges[root]))]
+        while work:
+            v, successors = work[-1]
+            for w in successors:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(edges[w])))
+                    break
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    yield component
+
+
+def type_to_json(type_object: TypeObject | None):
+    if type_object is None:
+        return None
+    return [type_object.base, None if type_object.params is None else [type_to_json(x) for x in type_object.params]]
+
+def type_from_json(data) -> TypeObject | None:
+    if data is None:
+        return None
+    base, params = data
+    return TypeObject(base, None if params is None else [type_from_json(x) for x in params], allow_partial=True)
+
+def type_names(data) -> set[str]:
+    # All strings in the JSON form of types
+    if isinstance(data, str):
+        return {data}
+    values = data.values() if isinstance(data, dict) else (data or [])
+    return set().union(*(type_names(x) for x in values))
+
+def lookup(key: str) -> dict | None:
+    if memo is not None:
+        entry = memo.get(key)
+        if entry is not None:
+            return entry
+    if not use_cache:
+        return None
+    data = codegen_cache.get(key)
+    if data is None:
+        return None
+    try:
+        entry = json.loads(data)
+    except ValueError:
+        return None     # Corrupted cache entry, which is replaced when the code is generated again
+    if memo is not None:
+        memo.put(key, entry)
+    return entry
+
+def store(key: str, entry: dict):
+    if memo is not None:
+        memo.put(key, entry)
+    if use_cache:
+        codegen_cache.put(key, json.dumps(entry).encode(), evict=False)
+
+def generate(key: str | None, to_code: Callable[[], str], to_declaration: Callable[[], str] | None = None) -> tuple[str | None, str]:
+    # Returns the forward declaration (if there is one) and the code for key from the cache, or generates them and adds
+    # them to the cache
+    if key is None:
+        return (to_declaration() if to_declaration is not None else None), to_code()
+
+    entry = lookup(key)
+    if entry is not None:
+        try:
+            for name, params, type_params in entry['instantiations']:
+                request_instantiation(name, [type_from_json(x) for x in params], {k: type_from_json(v) for k, v in type_params.items()})
+        except SereneError:
+            # Too many instantiations; the code is generated again, so that the error has the line number of the call
+            pass
+        else:
+            local.stats.hits += 1
+            return entry['declaration'], entry['code']
+
+    local.stats.misses += 1
+    start = len(scope.requested_instantiations)
+    declaration = to_declaration() if to_declaration is not None else None
+    code = to_code()
+    # Every instantiation that the code calls is recorded, not only the new ones, since the function that requested an
+    # instantiation first may be changed later so that it no longer does
+    instantiations = {}
+    for function, params, type_params in scope.requested_instantiations[start:]:
+        instantiation = [function.get_scalar(Symbol.identifier), [type_to_json(x) for x in params], {k: type_to_json(v) for k, v in type_params.items()}]
+        instantiations.setdefault(json.dumps(instantiation), instantiation)
+    del scope.requested_instantiations[start:]
+    store(key, {'declaration': declaration, 'code': code, 'instantiations': list(instantiations.values())})
+    return declaration, code
+
+def request_instantiation(name: str, params: list[TypeObject], type_params: dict[str, TypeObject]):
+    # Same as what FunctionCallNode.to_code does for a call to a generic function
+    if name not in scope.functions_by_name:
+        raise UnreachableError
+    scope.add_instantiation(scope.functions_by_name[name], params, type_params)
@@ -52,7 +52,7 @@ std::ostream& operator<<(std::ostream& os, const SN_Array<Data>& obj) {
 }
 
 template<>
-std::ostream& operator<<(std::ostream& os, const SN_Array<int8_t>& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_Array<int8_t>& obj) {
     os << "[";
     if (obj.length >= 1) {
         for (int i = 0; i < obj.length - 1; i++) {
@@ -65,7 +65,7 @@ std::ostream& operator<<(std::ostream& os, const SN_Array<int8_t>& obj) {
 }
 
 template<>
-std::ostream& operator<<(std::ostream& os, const SN_Array<uint8_t>& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_Array<uint8_t>& obj) {
     os << "[";
     if (obj.length >= 1) {
         for (int i = 0; i < obj.length - 1; i++) {
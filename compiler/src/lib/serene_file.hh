@@ -36,7 +36,7 @@ public:
     friend std::ostream& operator<<(std::ostream& os, const SN_File& obj);
 };
 
-std::ostream& operator<<(std::ostream& os, const SN_File& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_File& obj) {
     os << obj.path;
     return os;
 }
@@ -0,0 +1,16 @@
+// Includes the whole Serene runtime. Generated programs include only this header, so that it can be precompiled. (An
+// include guard is used instead of #pragma once, which g++ warns about when the header is compiled on its own.)
+
+#ifndef SERENE_RUNTIME_HH
+#define SERENE_RUNTIME_HH
+
+#include <iostream>
+#include <cstdint>
+#include "serene_printing.hh"
+#include "serene_array.hh"
+#include "serene_string.hh"
+#include "serene_vector.hh"
+#include "serene_file.hh"
+#include "serene_locale.hh"
+
+#endif
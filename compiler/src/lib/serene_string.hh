@@ -86,7 +86,7 @@ public:
     }
 };
 
-std::ostream& operator<<(std::ostream& os, const SN_String& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_String& obj) {
     for (auto x : obj) {
         os << x;
     }
@@ -83,7 +83,7 @@ std::ostream& operator<<(std::ostream& os, const SN_Vector<Data>& obj) {
 }
 
 template<>
-std::ostream& operator<<(std::ostream& os, const SN_Vector<int8_t>& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_Vector<int8_t>& obj) {
     os << "[";
     if (obj.length >= 1) {
         for (int i = 0; i < obj.length - 1; i++) {
@@ -96,7 +96,7 @@ std::ostream& operator<<(std::ostream& os, const SN_Vector<int8_t>& obj) {
 }
 
 template<>
-std::ostream& operator<<(std::ostream& os, const SN_Vector<uint8_t>& obj) {
+inline std::ostream& operator<<(std::ostream& os, const SN_Vector<uint8_t>& obj) {
     os << "[";
     if (obj.length >= 1) {
         for (int i = 0; i < obj.length - 1; i++) {
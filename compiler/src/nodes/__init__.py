@@ -1,2 +1,2 @@
-from .base import Node, NodeMap
+from .base import Node, NodeMap, node_classes
 from .subclass import *
\ No newline at end of file
@@ -6,38 +6,59 @@ from src import nodes, typecheck
 
 # Base Classes ________________________________________________________________
 
+# Indexes of NodeMaps by the symbols of their children, in order. Most NodeMaps have only a few children, and there are
+# only a few hundred different combinations of them, so NodeMaps with the same combination share the same index. Larger
+# NodeMaps (such as the statements of a function) each have their own index, so that this doesn't keep growing.
+indexes: dict[tuple[Symbol, ...], dict[Symbol, tuple[int, ...]]] = {}
+max_shared_index_size = 8
+
+def build_index(symbols: tuple[Symbol, ...]) -> dict[Symbol, tuple[int, ...]]:
+    positions = {}
+    for i, x in enumerate(symbols):
+        positions.setdefault(x, []).append(i)
+    return {k: tuple(v) for k, v in positions.items()}
+
+def index_for(symbols: tuple[Symbol, ...]) -> dict[Symbol, tuple[int, ...]]:
+    if len(symbols) > max_shared_index_size:
+        return build_index(symbols)
+    index = indexes.get(symbols)
+    if index is None:
+        index = indexes.setdefault(symbols, build_index(symbols))
+    return index
+
 class NodeMap:
+    # Code generation looks up children by their symbol all the time, so each NodeMap has an index from each symbol to
+    # the positions of the children with that symbol. Trees are not modified after they are built, so the index never
+    # changes.
+    __slots__ = ('data', 'positions')
+
     def __init__(self, L: list[dict]):
         if type(L) != list:
             raise TypeError
-        self.data = [Node.create(x) for x in L]
+        # Children may already be nodes, when the tree is built by the Python parser
+        self.data = [x if isinstance(x, Node) else Node.create(x) for x in L]
+        self.positions = index_for(tuple(y.nodetype for y in self.data))
     
     def __getitem__(self, x: int | Symbol):
         if isinstance(x, int):
             return self.data[x]
         if isinstance(x, Symbol):
-            for y in self.data:
-                if y.nodetype == x:
-                    return y
-            raise IndexError
+            positions = self.positions.get(x)
+            if positions is None:
+                raise IndexError
+            return self.data[positions[0]]
         raise TypeError
     
     def __contains__(self, x: int | Symbol):
         if isinstance(x, int):
             return x in self.data[x]
         if isinstance(x, Symbol):
-            for y in self.data:
-                if y.nodetype == x:
-                    return True
-            return False
+            return x in self.positions
         raise TypeError
     
     def count(self, x: Symbol):
-        c = 0
-        for y in self.data:
-            if y.nodetype == x:
-                c += 1
-        return c
+        positions = self.positions.get(x)
+        return 0 if positions is None else len(positions)
     
     def __len__(self):
         return len(self.data)
@@ -48,59 +69,62 @@ class NodeMap:
     def __repr__(self):
         return '\n'.join(repr(x) for x in self.data)
 
-# Node should be constructed with 'create', not regular constructor
+# Node classes for symbols that need more than the generic Node, filled in by nodes/subclass.py
+node_classes: dict[Symbol, Type[Node]] = {}
+symbols_by_name: dict[str, Symbol] = dict(Symbol.__members__)
+
+# Node should be constructed with 'create' or 'make', not regular constructor
 class Node:
+    # Subclasses (in subclass.py) also declare __slots__ for the attributes that they set, so no node has a __dict__
+    __slots__ = ('nodetype', 'data')
+
     @staticmethod
     def create(D: dict) -> Node:
-        if type(D) == dict:
-            assert(len(D) == 1)
-            mapping = {
-                Symbol.function:                nodes.FunctionNode,
-                Symbol.method_definition:       nodes.MethodDefinitionNode,
-                Symbol.function_parameter:      nodes.FunctionParameterNode,
-                Symbol.type:                    nodes.TypeNode,
-                Symbol.statement:               nodes.StatementNode,
-                Symbol.var_statement:           nodes.VarStatement,
-                Symbol.const_statement:         nodes.ConstStatement,
-                Symbol.set_statement:           nodes.SetStatement,
-                Symbol.print_statement:         nodes.PrintStatement,
-                Symbol.run_statement:           nodes.RunStatement,
-                Symbol.return_statement:        nodes.ReturnStatement,
-                Symbol.break_statement:         nodes.BreakStatement,
-                Symbol.continue_statement:      nodes.ContinueStatement,
-                Symbol.exit_statement:          nodes.ExitStatement,
-                Symbol.expression:              nodes.ExpressionNode,
-                Symbol.term:                    nodes.TermNode,
-                Symbol.place_term:              nodes.PlaceTermNode,
-                Symbol.base_expression:         nodes.BaseExpressionNode,
-                Symbol.function_call:           nodes.FunctionCallNode,
-                Symbol.method_call:             nodes.MethodCallNode,
-                Symbol.constructor_call:        nodes.ConstructorCallNode,
-                Symbol.index_call:              nodes.IndexCallNode,
-                Symbol.field_access:            nodes.FieldAccessNode,
-                Symbol.function_call_parameter: nodes.FunctionCallParameterNode,
-                Symbol.for_loop:                nodes.ForLoopNode,
-                Symbol.while_loop:              nodes.WhileLoopNode,
-                Symbol.if_block:                nodes.IfBlock,
-                Symbol.match_block:             nodes.MatchBlock,
-                Symbol.struct_definition:       nodes.StructDefinitionNode,
-            }
-            nodetypestr = list(D.keys())[0]
-            nodetype = Symbol[nodetypestr]
-            if nodetype in mapping:
-                return mapping[nodetype](D)
-            else:
-                return Node(D)
-        else:
-            raise TypeError
+        # Builds a tree from a parse tree in the form {symbol_name: [children] or scalar}. The tree is walked with an
+        # explicit stack, since expressions can be nested much deeper than Python's recursion limit: each dict is visited
+        # once in pre-order, and the nodes are then made in the reverse order, so that the children of each node are made
+        # before it. Children that are already nodes are used as they are.
+        order = []
+        pending = [D]
+        while pending:
+            x = pending.pop()
+            if isinstance(x, Node):
+                order.append((x, None, None))
+                continue
+            if type(x) != dict:
+                raise TypeError
+            assert(len(x) == 1)
+            for name, inside in x.items():
+                order.append((None, symbols_by_name[name], inside))
+                if type(inside) == list:
+                    pending.extend(reversed(inside))
+
+        # The children of each node are on top of 'made', with the first child last
+        made = []
+        for node, nodetype, inside in reversed(order):
+            if node is None:
+                if type(inside) == list:
+                    start = len(made) - len(inside)
+                    children = made[start:]
+                    children.reverse()
+                    del made[start:]
+                    inside = children
+                node = node_classes.get(nodetype, Node)(nodetype, inside)
+            made.append(node)
+        return made[0]
+
+    @staticmethod
+    def make(name: str, data: list[Node] | str | int) -> Node:
+        # Makes a single node whose children (if any) are already nodes
+        nodetype = symbols_by_name[name]
+        return node_classes.get(nodetype, Node)(nodetype, data)
 
-    def __init__(self, D):
-        self.nodetype = Symbol[list(D.keys())[0]]
-        inside = D[self.nodetype.name]
-        if type(inside) == list:
-            self.data = NodeMap(inside)
+    def __init__(self, nodetype: Symbol, data: list[Node] | str | int):
+        self.nodetype = nodetype
+        if type(data) == list:
+            self.data = NodeMap(data)
         else:
-            self.data = inside
+            self.data = data
         
     def __getitem__(self, x) -> Node:
         if type(self.data) == NodeMap:
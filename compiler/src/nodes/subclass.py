@@ -28,26 +28,19 @@ type_mapping = {'Int64':    'int64_t',
                }
 
 
-# Global Variables ____________________________________________________________
-
-indent_level = 0
-
-
 # Functions ___________________________________________________________________
 
 def add_indent():
-    global indent_level
-    oldindent = ('    '*indent_level)
-    indent_level += 1
-    newindent = ('    '*indent_level)
+    oldindent = ('    '*scope.indent_level)
+    scope.indent_level += 1
+    newindent = ('    '*scope.indent_level)
 
     return newindent, oldindent
 
 def sub_indent():
-    global indent_level
-    oldindent = ('    '*indent_level)
-    indent_level -= 1
-    newindent = ('    '*indent_level)
+    oldindent = ('    '*scope.indent_level)
+    scope.indent_level -= 1
+    newindent = ('    '*scope.indent_level)
 
     return newindent, oldindent
 
@@ -60,14 +53,14 @@ def get_cpp_type(my_type):
             return cpp_type
         else:  # Generic type
             return cpp_type + '<' + get_cpp_type(my_type.params[0]) + '>'
-    elif base in typecheck.user_defined_types:
+    elif base in scope.user_defined_types:
         return f"SN_{base}"
     else:
         raise SereneTypeError(f"Unknown type: {my_type}.")
 
 def check_basetype(base):
     assert type(base) == str
-    return (base in type_mapping) or (base in typecheck.user_defined_types)
+    return (base in type_mapping) or (base in scope.user_defined_types)
 
 def check_solidified(my_type):
     assert type(my_type) == TypeNode
@@ -119,14 +112,32 @@ class UnreachableError(Exception):
     # Compare with NotImplementedError, which is used here for known future features that have not yet been implemented.
     pass
 
+def memoize_type(get_type):
+    # Code generation asks for the type of the same expression or term many times (each operator checks the types of its
+    # operands, and the type of an expression includes the types of the expressions nested in it), so the types of each
+    # node are cached. The cache is only valid for the current instantiation of the type parameters, so it is cleared
+    # when scope.current_type_params or scope.type_generation (which FunctionNode.reset_scope changes) is different.
+    def memoized_get_type(self, expected_type=None):
+        generation = scope.type_generation
+        type_params = scope.current_type_params
+        cache = getattr(self, 'type_cache', None)
+        if cache is None or cache[0] != generation or cache[1] is not type_params:
+            cache = self.type_cache = (generation, type_params, {})
+        if expected_type in cache[2]:
+            return cache[2][expected_type]
+        result = cache[2][expected_type] = get_type(self, expected_type=expected_type)
+        return result
+    return memoized_get_type
+
 # Subclasses __________________________________________________________________
 
 class FunctionNode(nodes.Node):
-    def __init__(self, D):
-        super().__init__(D)
-        self.my_scope = scope.ScopeObject(scope.top_scope)
-    
+    __slots__ = ('my_scope', 'generic')
+
     def setup(self):
+        # The scope is created here rather than in the constructor, because nodes may be constructed on another thread
+        # (while parsing included files), which has a different compilation context
+        self.my_scope = scope.ScopeObject(scope.top_scope)
         scope.scope_for_setup = self.my_scope
 
         if Symbol.def_type_parameters in self:
@@ -156,6 +167,7 @@ class FunctionNode(nodes.Node):
         # Since a generic function's statements are processed multiple times (once for each instance of the type parameters),
         # this function resets all the variables in self.my_scope so there are no duplicates
         scope.scope_for_setup = self.my_scope
+        scope.type_generation += 1
 
         self.my_scope.bindings.clear()
         self.my_scope.persistent_bindings.clear()
@@ -228,6 +240,8 @@ class FunctionNode(nodes.Node):
         return code
 
 class MethodDefinitionNode(nodes.Node):
+    __slots__ = ('my_scope',)
+
     def to_tuple_description(self, parent_scope):
         # Should be used while struct definitions are being processed and before method definitions are processed (as it calls FunctionParameterNode.setup)
         
@@ -285,6 +299,8 @@ class MethodDefinitionNode(nodes.Node):
         return code
 
 class FunctionParameterNode(nodes.Node):
+    __slots__ = ('generic', 'code')
+
     # Function parameters need to be processed before other code so that function calls can be verified regardless of the order that functions are defined.
     # However, they need access to struct definitions, so the setup() function is called when forward declarations are created, which is before the function bodies are processed.
     def setup(self, generic=False):
@@ -343,6 +359,8 @@ class FunctionParameterNode(nodes.Node):
             return self.code
 
 class TypeNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self, allow_partial=False):
         base = self[Symbol.base_type].data
         num_generic_params = 0 if (Symbol.type_parameters not in self) else self[Symbol.type_parameters].count(Symbol.type)
@@ -350,7 +368,7 @@ class TypeNode(nodes.Node):
             return typecheck.TypeObject(base, allow_partial=allow_partial)
         elif num_generic_params == 1:
             if base not in ('Vector', 'Array'):
-                if base in typecheck.user_defined_types:
+                if base in scope.user_defined_types:
                     raise SereneTypeError(f"Unnecessary type parameter specified for non-generic type '{base}'.")
                 else:
                     raise SereneTypeError(f"Unknown generic type: {base}.")
@@ -362,8 +380,10 @@ class TypeNode(nodes.Node):
         return get_cpp_type(self.get_type())
 
 class StatementNode(nodes.Node):
-    def __init__(self, D):
-        super().__init__(D)
+    __slots__ = ('read_list', 'write_list', 'delete_list', 'satisfies_return', 'bindings_to_restore')
+
+    def __init__(self, nodetype, data):
+        super().__init__(nodetype, data)
         self.read_list = []     # Any variable that will be accessed with look or copy
         self.write_list = []    # Any variable that will be accessed with mutate or move
         self.delete_list = []   # Any variable that will be accessed with move
@@ -407,6 +427,8 @@ class StatementNode(nodes.Node):
         return code
 
 class VarStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         var_name = self.get_scalar(Symbol.identifier)
 
@@ -429,6 +451,8 @@ class VarStatement(nodes.Node):
         return f'{cpp_type} sn_{var_name} = {expr_code};\n'
 
 class ConstStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         var_name = self.get_scalar(Symbol.identifier)
 
@@ -451,6 +475,8 @@ class ConstStatement(nodes.Node):
         return f'const {cpp_type} sn_{var_name} = {expr_code};\n'
 
 class SetStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         assign_op = self.get_scalar(Symbol.assignment_op)
 
@@ -489,18 +515,24 @@ class SetStatement(nodes.Node):
         return f'{lhs_code} {assign_op} {expr_code};\n'
 
 class PrintStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         expr_code = [f"({x.to_code()})" for x in self]
         expr_code.append('std::endl;\n')
         return 'std::cout << ' + ' << '.join(expr_code)
 
 class RunStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         return self[Symbol.term].to_code() + ';\n'
 
 class ReturnStatement(nodes.Node):
-    def __init__(self, D):
-        super().__init__(D)
+    __slots__ = ('satisfies_return',)
+
+    def __init__(self, nodetype, data):
+        super().__init__(nodetype, data)
         if type(self.data) == nodes.NodeMap:
             self.satisfies_return = True
         else:
@@ -520,6 +552,8 @@ class ReturnStatement(nodes.Node):
             return 'return;\n'
 
 class BreakStatement(nodes.Node):
+    __slots__ = ()
+
     def to_code(self):
         if len(scope.loops) > 0:
             return 'break;\n'
@@ -527,6 +561,8 @@ class BreakStatement(nodes.Node):
             raise SereneScopeError(f"'break' cannot be used outside of a loop at line number {scope.line_number}.")
 
 class ContinueStatement(nodes.Node):
+    __slots__ = ('satisfies_return',)
+
     def to_code(self):
         if len(scope.loops) > 0:
             self.satisfies_return = scope.loops[-1].is_infinite
@@ -535,11 +571,17 @@ class ContinueStatement(nodes.Node):
             raise SereneScopeError(f"'continue' cannot be used outside of a loop at line number {scope.line_number}.")
 
 class ExitStatement(nodes.Node):
+    __slots__ = ('satisfies_return',)
+
     def to_code(self):
         self.satisfies_return = True
         return f"exit({self.get_scalar(Symbol.int_literal)});\n"
 
 class ExpressionNode(nodes.Node):
+    __slots__ = ('type_cache', 'read_list', 'write_list', 'delete_list', 'is_temporary')
+
+
+    @memoize_type
     def get_type(self, expected_type=None):
         if (self.count(Symbol.term) > 1):
             last_type = None
@@ -649,10 +691,13 @@ class ExpressionNode(nodes.Node):
         return code
 
 class TermNode(nodes.Node):
+    __slots__ = ('type_cache', 'is_temporary', 'var_tup')
+
+
     def get_type_sequence(self, expected_type=None, type_params=None):
         L: list[typecheck.TypeObject] = []
         base_type = self[0].get_type(expected_type=expected_type)
-        if base_type.base not in type_mapping and base_type.base not in typecheck.user_defined_types:
+        if base_type.base not in type_mapping and base_type.base not in scope.user_defined_types:
             if type_params is not None and base_type.base in type_params:
                 base_type = type_params[base_type.base]
             else:
@@ -669,8 +714,8 @@ class TermNode(nodes.Node):
 
             if prev_type.base in typecheck.standard_types:
                 prev_type_spec = typecheck.standard_types[prev_type.base]
-            elif prev_type.base in typecheck.user_defined_types:
-                prev_type_spec = typecheck.user_defined_types[prev_type.base]
+            elif prev_type.base in scope.user_defined_types:
+                prev_type_spec = scope.user_defined_types[prev_type.base]
             else:
                 raise SereneTypeError(f"Unknown type in expression at line number {scope.line_number}.")
             
@@ -684,6 +729,7 @@ class TermNode(nodes.Node):
                 raise UnreachableError          
         return L
     
+    @memoize_type
     def get_type(self, expected_type=None):
         this_type = self.get_type_sequence(expected_type=expected_type, type_params=scope.current_type_params)[-1]
         if this_type is None:
@@ -763,9 +809,13 @@ class TermNode(nodes.Node):
         return code
 
 class PlaceTermNode(TermNode):  # Identical to TermNode, except with no method calls (prevented in the parsing stage). Used for 'set' statements
+    __slots__ = ()
+
     pass
 
 class FieldAccessNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self, prev_type_spec):
         field_name = self[Symbol.identifier].data
         if field_name in prev_type_spec.members:
@@ -780,6 +830,8 @@ class FieldAccessNode(nodes.Node):
         return '.sn_' + self.get_scalar(Symbol.identifier)
 
 class MethodCallNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self, prev_type, prev_type_spec, is_last = False):
         method_name = self[Symbol.identifier].data + ('!' if Symbol.mutate_method_symbol in self else '')
         if method_name in prev_type_spec.methods:
@@ -806,8 +858,8 @@ class MethodCallNode(nodes.Node):
         method_name = self.get_scalar(Symbol.identifier)
         if prev_type.base in typecheck.standard_types:
             orig_type = typecheck.standard_types[prev_type.base]
-        elif prev_type.base in typecheck.user_defined_types:
-            orig_type = typecheck.user_defined_types[prev_type.base]
+        elif prev_type.base in scope.user_defined_types:
+            orig_type = scope.user_defined_types[prev_type.base]
         else:
             raise UnreachableError
     
@@ -848,6 +900,8 @@ class MethodCallNode(nodes.Node):
         return code
 
 class IndexCallNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self, prev_type):
         if prev_type.base in ('Vector', 'Array'):
             if self[Symbol.expression].get_type().base != 'Int64':
@@ -864,6 +918,8 @@ class IndexCallNode(nodes.Node):
         return '[' + self[Symbol.expression].to_code() + ']'
 
 class BaseExpressionNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self, expected_type=None):
         if Symbol.literal in self:
             if Symbol.type_solidifier in self[Symbol.literal] or expected_type is not None:
@@ -1004,6 +1060,8 @@ class BaseExpressionNode(nodes.Node):
             raise UnreachableError
 
 class FunctionCallNode(nodes.Node):
+    __slots__ = ('return_type',)
+
     def to_code(self, cache_types_only=False):
         if self.get_scalar(Symbol.identifier) not in scope.function_names:
             raise SereneScopeError(f"Function '{self.get_scalar(Symbol.identifier)}' is not defined at line number {scope.line_number}.")
@@ -1034,15 +1092,12 @@ class FunctionCallNode(nodes.Node):
             for x in self[Symbol.function_call_parameters]:
                 call_param_types.append(solidify_with_type_params(x[Symbol.expression].get_type()))
             
-            already_exists = False
-            for i in range(len(original_function.my_scope.generic_combos_params)):
-                if call_param_types == original_function.my_scope.generic_combos_params[i]:
-                    already_exists = True
-                    reset_type_temp = True
-                    for name, tparam in original_function.my_scope.type_parameters.items():
-                        tparam.type_temp = original_function.my_scope.generic_combos_type_params[i][name]
-                    break
-            
+            existing_type_params = original_function.my_scope.instantiations.get(tuple(call_param_types))
+            if existing_type_params is not None:
+                reset_type_temp = True
+                for name, tparam in original_function.my_scope.type_parameters.items():
+                    tparam.type_temp = existing_type_params[name]
+
             orig_param_types = [p[Symbol.type].get_type() for p in original_function[Symbol.function_parameters]]
             for i in range(len(orig_param_types)):
                 orig_cur = orig_param_types[i]
@@ -1076,10 +1131,6 @@ class FunctionCallNode(nodes.Node):
                 for x in original_function.my_scope.type_parameters.values():
                     x.type_temp = None
 
-            if not already_exists:
-                original_function.my_scope.generic_combos_params.append(call_param_types)
-                original_function.my_scope.generic_combos_type_params.append(generic_combos_type_params_temp)
-
             if Symbol.type in original_function:
                 base = original_function[Symbol.type].get_scalar(Symbol.base_type)
                 if check_basetype(base):
@@ -1093,8 +1144,7 @@ class FunctionCallNode(nodes.Node):
                     else:
                         raise SereneTypeError(f"Unknown type: {base}.")
 
-            if not already_exists:
-                scope.remaining_generic_functions.append((original_function, generic_combos_params_temp, generic_combos_type_params_temp))
+            scope.add_instantiation(original_function, generic_combos_params_temp, generic_combos_type_params_temp)
 
         if cache_types_only:
             return
@@ -1122,6 +1172,8 @@ class FunctionCallNode(nodes.Node):
         return code
 
 class ConstructorCallNode(nodes.Node):
+    __slots__ = ()
+
     def get_type(self):
         type_name = self.get_scalar(Symbol.base_type)
         if type_name == 'Array':
@@ -1143,7 +1195,7 @@ class ConstructorCallNode(nodes.Node):
                 if param.nodetype == Symbol.expression and param.get_type().base == 'String':
                     return typecheck.TypeObject(base='File')
             raise SereneTypeError(f"Invalid parameters for type constructor called at line number {scope.line_number}.")
-        elif type_name in typecheck.user_defined_types:
+        elif type_name in scope.user_defined_types:
             return typecheck.TypeObject(base=type_name)
         else:
             raise SereneTypeError(f"Type constructor called at line number {scope.line_number} is not defined.")
@@ -1200,8 +1252,8 @@ class ConstructorCallNode(nodes.Node):
                     inner_code = param.to_code()
                     return f"SN_File({inner_code})"
             raise SereneTypeError(f"Invalid parameters for type constructor called at line number {scope.line_number}.")
-        elif type_name in typecheck.user_defined_types:
-            type_spec = typecheck.user_defined_types[type_name]
+        elif type_name in scope.user_defined_types:
+            type_spec = scope.user_defined_types[type_name]
             fields = []
             field_type = None
 
@@ -1228,6 +1280,8 @@ class ConstructorCallNode(nodes.Node):
         
 
 class FunctionCallParameterNode(nodes.Node):
+    __slots__ = ()
+
     def to_code(self, original_accessor, original_type, function_name, param_name, method=False):
         if Symbol.accessor in self:
             my_accessor = self.get_scalar(Symbol.accessor)
@@ -1251,8 +1305,10 @@ class FunctionCallParameterNode(nodes.Node):
         return code
 
 class ForLoopNode(nodes.Node):
-    def __init__(self, D):
-        super().__init__(D)
+    __slots__ = ('is_infinite',)
+
+    def __init__(self, nodetype, data):
+        super().__init__(nodetype, data)
         self.is_infinite = False
 
     def to_code(self):
@@ -1298,8 +1354,10 @@ class ForLoopNode(nodes.Node):
         return code
 
 class WhileLoopNode(nodes.Node):
-    def __init__(self, D):
-        super().__init__(D)
+    __slots__ = ('is_infinite', 'satisfies_return')
+
+    def __init__(self, nodetype, data):
+        super().__init__(nodetype, data)
 
         condition_is_true = False   # check for "while (True) ...", "while ((((True)))) ...", etc.
         cur = self[Symbol.expression]
@@ -1338,6 +1396,8 @@ class WhileLoopNode(nodes.Node):
         return code
 
 class IfBlock(nodes.Node):
+    __slots__ = ('satisfies_return',)
+
     def to_code(self):
         newindent, oldindent = add_indent()
 
@@ -1407,6 +1467,8 @@ class IfBlock(nodes.Node):
         return code
 
 class MatchBlock(nodes.Node):
+    __slots__ = ('satisfies_return',)
+
     def to_code(self):
         newindent, oldindent = add_indent()
 
@@ -1453,21 +1515,23 @@ class MatchBlock(nodes.Node):
         return (f'{oldindent}else ').join(branches)
 
 class StructDefinitionNode(nodes.Node):
+    __slots__ = ('my_scope',)
+
     @staticmethod
     def topological_ordering():
         # Consider struct definitions as a directed graph
         G = dict()
 
         # We don't want the whole TypeSpecification object, just a list of adjacent nodes. (We also don't want to modify the TypeSpecification objects, which are used elsewhere.)
-        for key, value in typecheck.user_defined_types.items():
+        for key, value in scope.user_defined_types.items():
             L = []
             for x in value.members.values():
-                if x.base in typecheck.user_defined_types:
+                if x.base in scope.user_defined_types:
                     L.append(x.base)
                 elif x.base in ('Vector', 'Array'):
                     y = x.params[0]
                     while True:
-                        if y.base in typecheck.user_defined_types:
+                        if y.base in scope.user_defined_types:
                             L.append(x.params[0].base)
                             break
                         elif y.base in ('Vector', 'Array'):
@@ -1595,3 +1659,37 @@ class StructDefinitionNode(nodes.Node):
         code = f"struct SN_{struct_name} {{\n{inner_code}}};\n"
         code += f"VISITABLE_STRUCT({visiting_code});"
         return code
+
+
+# Node classes for each symbol, used by Node.create and Node.make. Other symbols use Node itself.
+nodes.node_classes.update({
+    Symbol.function:                FunctionNode,
+    Symbol.method_definition:       MethodDefinitionNode,
+    Symbol.function_parameter:      FunctionParameterNode,
+    Symbol.type:                    TypeNode,
+    Symbol.statement:               StatementNode,
+    Symbol.var_statement:           VarStatement,
+    Symbol.const_statement:         ConstStatement,
+    Symbol.set_statement:           SetStatement,
+    Symbol.print_statement:         PrintStatement,
+    Symbol.run_statement:           RunStatement,
+    Symbol.return_statement:        ReturnStatement,
+    Symbol.break_statement:         BreakStatement,
+    Symbol.continue_statement:      ContinueStatement,
+    Symbol.exit_statement:          ExitStatement,
+    Symbol.expression:              ExpressionNode,
+    Symbol.term:                    TermNode,
+    Symbol.place_term:              PlaceTermNode,
+    Symbol.base_expression:         BaseExpressionNode,
+    Symbol.function_call:           FunctionCallNode,
+    Symbol.method_call:             MethodCallNode,
+    Symbol.constructor_call:        ConstructorCallNode,
+    Symbol.index_call:              IndexCallNode,
+    Symbol.field_access:            FieldAccessNode,
+    Symbol.function_call_parameter: FunctionCallParameterNode,
+    Symbol.for_loop:                ForLoopNode,
+    Symbol.while_loop:              WhileLoopNode,
+    Symbol.if_block:                IfBlock,
+    Symbol.match_block:             MatchBlock,
+    Symbol.struct_definition:       StructDefinitionNode,
+})
@@ -0,0 +1,1018 @@
+from __future__ import annotations
+
+import re
+import bisect
+import unicodedata
+from typing import Any, Callable
+
+from src.common import *
+from src import nodes
+
+# Python implementation of the grammar in parser.raku, which is used with the --parser=python option. Each node of the
+# tree is built by make_node(name, children or matched text). By default, the nodes are dicts of the same form as the
+# Raku parser's output ({symbol_name: [children]} or {symbol_name: 'matched text'}), but parse_nodes() builds Node
+# objects directly, so that no intermediate tree is created.
+
+# The grammar is translated rule-by-rule. Raku tokens and rules both use :ratchet, so once an element has matched it
+# is never revisited, which is the same behavior as a PEG. In a Raku 'rule', whitespace after an atom in the rule body
+# is significant and is replaced with a call to <.ws>; the calls to self.ws() below mark those places.
+
+keywords = ('look', 'mutate', 'move', 'copy', 'var', 'const', 'set', 'function', 'type',
+            'if', 'elseif', 'else', 'for', 'while', 'break', 'continue', 'exit', 'return', 'and', 'or', 'not',
+            'run', 'match', 'struct', 'import', 'private', 'in')
+
+literal_punctuation = frozenset(" !#$%&()*+,-./:;<=>?@[~]^_`{|}")
+
+vertical_space = frozenset('\n\r\x0b\x0c\x85\u2028\u2029')
+
+def is_horizontal_space(c):
+    return c == ' ' or c == '\t' or (c not in vertical_space and unicodedata.category(c) == 'Zs')
+
+def is_alnum(c):    # Raku's <alnum> and \w both include underscores
+    return c.isalpha() or c.isdigit() or c == '_'
+
+class _NoMatch(Exception):
+    pass
+
+class Parser:
+    def __init__(self, text: str, make_node: Callable[[str, list | str | int], Any] = None):
+        self.text = text
+        self.make_node = make_node if make_node is not None else (lambda name, data: {name: data})
+        self.length = len(text)
+        self.pos = 0
+        self.last = 0       # Equivalent to $*LAST in parser.raku: the last line number where a separator or comment was matched
+        self.newlines = [m.start() for m in re.finditer('\n', text)]
+
+    def line_num(self, pos):
+        return bisect.bisect_left(self.newlines, pos) + 1
+
+    def parse(self):
+        self.ws()
+        self.separator()
+        self.ws()
+        tree = self.match('definitions')
+        self.ws()
+        self.separator()
+        self.ws()
+        if self.pos != self.length:
+            self.error("")
+        return tree
+
+    # Error reporting _________________________________________________________
+
+    def error(self, message):
+        lines = self.text.splitlines()
+        if message == "":
+            line = self.last + 1
+            while True:
+                if line > len(lines):
+                    raise SereneSyntaxError("COMPILE ERROR:\nInvalid syntax at end of file.")
+                text = lines[line - 1].strip()
+                if re.search(r'\w', text):
+                    break
+                line += 1
+            raise SereneSyntaxError(f"COMPILE ERROR:\nInvalid syntax at line number {line}:\n  - Code: ``` {text} ```\n")
+        else:
+            line = self.line_num(self.pos)
+            text = lines[line - 1].strip() if line <= len(lines) else ''
+            raise SereneSyntaxError(f"COMPILE ERROR:\nInvalid syntax at line number {line}:\n  - Code: ``` {text} ```\n  - {message}\n")
+
+    # Matching utilities ______________________________________________________
+
+    def match(self, name):
+        # Equivalent to a named capture like <name>. Returns None (and restores the position) if there is no match.
+        start = self.pos
+        caps = []
+        try:
+            getattr(self, '_' + name)(caps)
+        except _NoMatch:
+            self.pos = start
+            return None
+        if len(caps) > 0:
+            return self.make_node(name, caps)
+        else:
+            return self.make_node(name, self.text[start:self.pos])
+
+    def cap(self, caps, name):
+        node = self.match(name)
+        if node is None:
+            raise _NoMatch
+        caps.append(node)
+
+    def optional_cap(self, caps, name):
+        node = self.match(name)
+        if node is not None:
+            caps.append(node)
+        return node is not None
+
+    def group(self, caps, func):
+        # Equivalent to an optional group like [ ... ]? where func raises _NoMatch on failure
+        start = self.pos
+        inner = []
+        try:
+            func(inner)
+        except _NoMatch:
+            self.pos = start
+            return False
+        caps.extend(inner)
+        return True
+
+    def lit(self, s):
+        if self.text.startswith(s, self.pos):
+            self.pos += len(s)
+            return True
+        return False
+
+    def need(self, s):
+        if not self.lit(s):
+            raise _NoMatch
+
+    def ws(self):
+        # token ws { <!ww> \h* }
+        pos = self.pos
+        if 0 < pos < self.length and is_alnum(self.text[pos - 1]) and is_alnum(self.text[pos]):
+            raise _NoMatch
+        while pos < self.length and is_horizontal_space(self.text[pos]):
+            pos += 1
+        self.pos = pos
+
+    def try_ws(self):
+        try:
+            self.ws()
+        except _NoMatch:
+            return False
+        return True
+
+    def skip_horizontal(self):
+        while self.pos < self.length and is_horizontal_space(self.text[self.pos]):
+            self.pos += 1
+
+    def at_line_end(self):     # $$
+        return self.pos == self.length or self.text[self.pos] == '\n' or self.text.startswith('\r\n', self.pos)
+
+    # File structure and whitespace ___________________________________________
+
+    def separator(self):
+        start = self.pos
+        line_end = self.line_separator()
+        line_pos = self.pos
+        self.pos = start
+        end_end = self.end_separator()
+        end_pos = self.pos
+
+        if line_end and (not end_end or line_pos >= end_pos):
+            self.pos = line_pos
+        elif end_end:
+            self.pos = end_pos
+        else:
+            self.pos = start
+            return False
+        self.last = max(self.line_num(start), self.last)
+        return True
+
+    def vertical_lines(self):
+        # [ \h* <.comment>? \v ]*
+        count = 0
+        while True:
+            pos = self.pos
+            self.skip_horizontal()
+            self.comment()
+            if self.pos < self.length and self.text[self.pos] in vertical_space:
+                self.pos += 1
+                count += 1
+            else:
+                self.pos = pos
+                return count
+
+    def line_separator(self):
+        if self.vertical_lines() == 0:
+            return False
+        self.skip_horizontal()
+        return True
+
+    def end_separator(self):
+        self.vertical_lines()
+        self.skip_horizontal()
+        self.comment()
+        return self.pos == self.length
+
+    def comma_sp(self):
+        if not self.lit(','):
+            return False
+        self.separator()
+        return True
+
+    def comment(self):
+        start = self.pos
+        if self.line_comment() or self.multiline_comment():
+            self.last = max(self.line_num(start), self.last)
+            return True
+        self.pos = start
+        return False
+
+    def line_comment(self):
+        if not self.lit('//'):
+            return False
+        while self.pos < self.length and self.text[self.pos] not in vertical_space:
+            self.pos += 1
+        return True
+
+    def multiline_comment(self):
+        start = self.pos
+        if not self.lit('/*'):
+            return False
+        end = self.text.find('*/', self.pos)
+        while end != -1:
+            self.pos = end + 2
+            if self.at_line_end():
+                return True
+            end = self.text.find('*/', end + 1)
+        self.pos = start
+        return False
+
+    def separated(self, caps, name, separator):
+        # Equivalent to <name>* %% <separator> inside a rule
+        if not self.optional_cap(caps, name):
+            return
+        while True:
+            pos = self.pos
+            if not (self.try_ws() and separator() and self.try_ws()):
+                self.pos = pos
+                return
+            if not self.optional_cap(caps, name):
+                return
+
+    # Main language grammar ___________________________________________________
+
+    def _definitions(self, caps):
+        while True:
+            pos = self.pos
+            if not (self.optional_cap(caps, 'function') or self.optional_cap(caps, 'struct_definition') or self.optional_cap(caps, 'include_statement')):
+                if (self.match('var_statement') is not None) or (self.match('const_statement') is not None):
+                    self.error("Global variables are not allowed.")
+                self.pos = pos
+                return
+            if not self.separator():
+                return
+
+    def _statements(self, caps):
+        while True:
+            if not self.optional_cap(caps, 'statement'):
+                return
+            if self.separator():
+                continue
+            pos = self.pos
+            if self.try_ws() and self.lit(';'):
+                self.error("Statements are terminated with newline characters, not semicolons.")
+            self.pos = pos
+            return
+
+    statement_types = ('print_statement', 'var_statement', 'const_statement', 'set_statement', 'run_statement',
+                       'return_statement', 'break_statement', 'continue_statement', 'exit_statement',
+                       'while_loop', 'for_loop', 'if_block', 'match_block')
+
+    def _statement(self, caps):
+        start = self.pos
+        for name in self.statement_types:
+            node = self.match(name)
+            if node is not None:
+                caps.append(self.make_node('line_number', self.line_num(start)))
+                caps.append(node)
+                return
+
+        if self.match('function_call') is not None:
+            self.error("Function calls cannot be used as statements. Use the 'run' keyword.")
+        self.pos = start
+
+        if self.match('base_expression') is not None:
+            while True:
+                if self.match('method_call') is not None:
+                    self.error("Method calls cannot be used as statements. Use the 'run' keyword.")
+                if (self.match('field_access') is None) and (self.match('index_call') is None):
+                    break
+        self.pos = start
+        raise _NoMatch
+
+    def _literal(self, caps):
+        if not (self.optional_cap(caps, 'float_literal') or self.optional_cap(caps, 'int_literal') or
+                self.optional_cap(caps, 'string_literal') or self.optional_cap(caps, 'char_literal') or
+                self.optional_cap(caps, 'bool_literal') or self.optional_cap(caps, 'collection_literal')):
+            raise _NoMatch
+
+        def solidifier(inner):
+            self.ws()
+            self.cap(inner, 'type_solidifier')
+        self.group(caps, solidifier)
+
+    def digits(self):
+        start = self.pos
+        while self.pos < self.length and self.text[self.pos].isdecimal():
+            self.pos += 1
+        return self.pos > start
+
+    def _int_literal(self, caps):
+        if not self.digits():
+            raise _NoMatch
+
+    def _float_literal(self, caps):
+        if not (self.digits() and self.lit('.')):
+            raise _NoMatch
+        self.digits()
+
+    def literal_char(self, quote):
+        # One character (or escape sequence) of a string or char literal. 'quote' is the other kind of quote, which is allowed unescaped.
+        if self.pos >= self.length:
+            return False
+        c = self.text[self.pos]
+        if is_alnum(c) or c in literal_punctuation or c == quote:
+            self.pos += 1
+            return True
+        return self.lit('\\n') or self.lit('\\\\') or self.lit('\\' + ('"' if quote == "'" else "'"))
+
+    def _string_literal(self, caps):
+        self.need('"')
+        while self.literal_char("'"):
+            pass
+        self.need('"')
+
+    def _char_literal(self, caps):
+        self.need("'")
+        if not self.literal_char('"'):
+            raise _NoMatch
+        self.need("'")
+
+    def _bool_literal(self, caps):
+        if not (self.lit('True') or self.lit('False')):
+            raise _NoMatch
+
+    def _collection_literal(self, caps):
+        self.need('[')
+        self.ws()
+        self.separated(caps, 'expression', self.comma_sp)
+        self.ws()
+        self.need(']')
+        self.ws()
+
+    def _type_solidifier(self, caps):
+        self.need('as')
+        self.ws()
+        self.cap(caps, 'type')
+        self.ws()
+
+    def _identifier(self, caps):
+        start = self.pos
+        for keyword in keywords:
+            if self.text.startswith(keyword, start):
+                end = start + len(keyword)
+                if end == self.length or not is_alnum(self.text[end]):
+                    self.pos = end
+                    self.error("")
+                break
+        if start < self.length and self.text[start].islower():
+            self.pos += 1
+            while self.pos < self.length and is_alnum(self.text[self.pos]):
+                self.pos += 1
+        else:
+            raise _NoMatch
+
+    def _base_type(self, caps):
+        if self.pos < self.length and self.text[self.pos].isupper():
+            self.pos += 1
+            while self.pos < self.length and is_alnum(self.text[self.pos]):
+                self.pos += 1
+        else:
+            raise _NoMatch
+
+    def _type(self, caps):
+        def generic(inner):
+            self.cap(inner, 'base_type')
+            self.ws()
+            self.need('of')
+            self.ws()
+            self.cap(inner, 'type_parameters')
+            self.ws()
+        if not self.group(caps, generic):
+            self.cap(caps, 'base_type')
+            self.ws()
+        self.ws()
+
+    def one_of(self, options):
+        for x in options:
+            if self.lit(x):
+                return True
+        raise _NoMatch
+
+    def _assignment_op(self, caps):
+        self.one_of(('=', '+=', '-=', '*=', '/=', '%='))
+
+    def _infix_op(self, caps):
+        if not self.optional_cap(caps, 'comparison_op'):
+            self.one_of(('+', '-', '*', '/', '%', 'and', 'or'))
+
+    def _comparison_op(self, caps):
+        self.one_of(('==', '>=', '<=', '!=', '>', '<'))
+
+    def _unary_op(self, caps):
+        self.one_of(('-', 'not'))
+
+    def _accessor(self, caps):
+        self.one_of(('mutate', 'move', 'copy'))
+
+    # Type definitions ________________________________________________________
+
+    def _struct_member(self, caps):
+        self.cap(caps, 'identifier')
+        self.ws()
+        self.need(':')
+        self.ws()
+        self.cap(caps, 'type')
+        self.ws()
+
+    def need_separator(self):
+        if not self.separator():
+            raise _NoMatch
+
+    def _struct_definition(self, caps):
+        self.need('type')
+        self.ws()
+        self.cap(caps, 'base_type')
+        self.ws()
+        self.need('struct')
+        self.ws()
+        self.separator()
+        self.ws()
+        self.need('{')
+        self.ws()
+        self.need_separator()
+        self.ws()
+
+        def member_with_comma(inner):
+            self.cap(inner, 'struct_member')
+            self.ws()
+            self.need(',')
+            self.ws()
+            self.need_separator()
+            self.ws()
+        while self.group(caps, member_with_comma):
+            pass
+        self.ws()
+
+        def last_member(inner):
+            self.cap(inner, 'struct_member')
+            self.ws()
+            self.need_separator()
+            self.ws()
+        self.group(caps, last_member)
+        self.ws()
+
+        self.need('}')
+        self.ws()
+
+        def extensions(inner):
+            self.need('with')
+            self.ws()
+            self.need_separator()
+            self.ws()
+            self.cap(inner, 'extension')
+            while True:
+                pos = self.pos
+                if not (self.try_ws() and self.separator() and self.try_ws() and self.optional_cap(inner, 'extension')):
+                    self.pos = pos
+                    break
+            self.ws()
+        self.group(caps, extensions)
+        self.ws()
+
+    def _extension(self, caps):
+        if not (self.optional_cap(caps, 'definitions_extension') or self.optional_cap(caps, 'policies_extension')):
+            raise _NoMatch
+        self.ws()
+
+    def _definitions_extension(self, caps):
+        self.need('~')
+        self.ws()
+        self.need('definitions')
+        self.ws()
+        self.need('{')
+        self.ws()
+        self.need_separator()
+        self.ws()
+        self.cap(caps, 'method_definitions')
+        self.ws()
+        self.need('}')
+        self.ws()
+
+    def _policies_extension(self, caps):
+        self.need('~')
+        self.ws()
+        self.need('policies')
+        self.ws()
+        self.need('{')
+        self.ws()
+        self.error("Policies are not yet supported.")
+
+    def _method_definitions(self, caps):
+        self.separated(caps, 'method_definition', self.separator)
+        self.ws()
+
+    def _include_statement(self, caps):
+        self.need('include')
+        self.ws()
+        self.cap(caps, 'file_name')
+        self.ws()
+
+    def _file_name(self, caps):
+        start = self.pos
+        while self.pos < self.length and (is_alnum(self.text[self.pos]) or self.text[self.pos] in '-/'):
+            self.pos += 1
+        if self.pos == start:
+            raise _NoMatch
+        self.need('.sn')
+
+    # Function definitions and calls __________________________________________
+
+    def block(self, caps):
+        # '{' <.separator> <statements> '}' at the end of a rule
+        self.need('{')
+        self.ws()
+        self.need_separator()
+        self.ws()
+        self.cap(caps, 'statements')
+        self.ws()
+        self.need('}')
+        self.ws()
+
+    def return_type(self, caps):
+        def arrow(inner):
+            self.separator()
+            self.ws()
+            self.need('->')
+            self.ws()
+            self.cap(inner, 'type')
+            self.ws()
+        self.group(caps, arrow)
+        self.ws()
+
+    def _function(self, caps):
+        self.need('function')
+        self.ws()
+        self.cap(caps, 'identifier')
+        self.ws()
+        self.need('(')
+        self.ws()
+        self.cap(caps, 'function_parameters')
+        self.ws()
+        self.need(')')
+        self.ws()
+
+        def type_parameters(inner):
+            self.separator()
+            self.ws()
+            self.need('on')
+            self.ws()
+            self.cap(inner, 'def_type_parameters')
+            self.ws()
+        self.group(caps, type_parameters)
+        self.ws()
+
+        self.return_type(caps)
+        self.separator()
+        self.ws()
+        self.block(caps)
+
+    def _method_definition(self, caps):
+        self.need('method')
+        self.ws()
+        self.cap(caps, 'identifier')
+        self.ws()
+        self.optional_cap(caps, 'mutate_method_symbol')
+        self.ws()
+        self.need('(')
+        self.ws()
+        self.cap(caps, 'function_parameters')
+        self.ws()
+        self.need(')')
+        self.ws()
+        self.return_type(caps)
+        self.separator()
+        self.ws()
+        self.block(caps)
+
+    def _function_parameters(self, caps):
+        self.separated(caps, 'function_parameter', self.comma_sp)
+        self.ws()
+
+    def _function_parameter(self, caps):
+        self.optional_cap(caps, 'accessor')
+        self.ws()
+        self.cap(caps, 'identifier')
+        self.ws()
+        if not (self.lit(':') and self.try_ws() and self.optional_cap(caps, 'type')):
+            self.error("Function parameter has no type specified.")
+        self.ws()
+
+    def _function_call(self, caps):
+        self.cap(caps, 'identifier')
+        self.need('(')
+        self.cap(caps, 'function_call_parameters')
+        self.need(')')
+
+    def _function_call_parameters(self, caps):
+        self.separated(caps, 'function_call_parameter', self.comma_sp)
+        self.ws()
+
+    def _function_call_parameter(self, caps):
+        self.optional_cap(caps, 'accessor')
+        self.ws()
+        self.cap(caps, 'expression')
+        self.ws()
+
+    def _constructor_call(self, caps):
+        self.cap(caps, 'base_type')
+        self.need('(')
+        self.cap(caps, 'constructor_call_parameters')
+        self.need(')')
+
+    def _constructor_call_parameters(self, caps):
+        self.separated(caps, 'constructor_call_parameter', self.comma_sp)
+        self.ws()
+
+    def _constructor_call_parameter(self, caps):
+        def expression(inner):
+            self.optional_cap(inner, 'accessor')
+            self.ws()
+            self.cap(inner, 'expression')
+            self.ws()
+        if not self.group(caps, expression):
+            self.cap(caps, 'type')
+            self.ws()
+
+    def _type_parameters(self, caps):
+        def multiple(inner):
+            self.need('(')
+            self.ws()
+            self.cap(inner, 'type')
+            while True:
+                pos = self.pos
+                if not (self.try_ws() and self.comma_sp() and self.try_ws() and self.optional_cap(inner, 'type')):
+                    self.pos = pos
+                    break
+            self.ws()
+            self.need(')')
+            self.ws()
+        if not self.group(caps, multiple):
+            self.cap(caps, 'type')
+            self.ws()
+
+    def _def_type_parameters(self, caps):
+        def one(inner):
+            self.need('type')
+            self.ws()
+            self.cap(inner, 'base_type')
+            self.ws()
+        def multiple(inner):
+            self.need('(')
+            self.ws()
+            one(inner)
+            while True:
+                pos = self.pos
+                if not (self.try_ws() and self.comma_sp() and self.try_ws() and self.group(inner, one)):
+                    self.pos = pos
+                    break
+            self.ws()
+            self.need(')')
+            self.ws()
+        if not (self.group(caps, one) or self.group(caps, multiple)):
+            raise _NoMatch
+
+    def _mutate_method_symbol(self, caps):
+        self.need('!')
+
+    def _method_call(self, caps):
+        self.need('.')
+        self.cap(caps, 'identifier')
+        self.optional_cap(caps, 'mutate_method_symbol')
+        self.need('(')
+        self.cap(caps, 'function_call_parameters')
+        self.need(')')
+
+    def _field_access(self, caps):
+        self.need('.')
+        self.cap(caps, 'identifier')
+
+    def _index_call(self, caps):
+        self.need('[')
+        self.cap(caps, 'expression')
+        self.need(']')
+
+    # Expressions _____________________________________________________________
+
+    def _expression(self, caps):
+        self.optional_cap(caps, 'unary_op')
+        self.ws()
+        self.cap(caps, 'term')
+        self.ws()
+
+        def operation(inner):
+            self.cap(inner, 'infix_op')
+            self.ws()
+            self.optional_cap(inner, 'unary_op')
+            self.ws()
+            self.cap(inner, 'term')
+            self.ws()
+        while self.group(caps, operation):
+            pass
+        self.ws()
+
+    def _base_expression(self, caps):
+        if not (self.optional_cap(caps, 'function_call') or self.optional_cap(caps, 'constructor_call') or
+                self.optional_cap(caps, 'identifier') or self.optional_cap(caps, 'literal')):
+            self.need('(')
+            self.ws()
+            self.cap(caps, 'expression')
+            self.ws()
+            self.need(')')
+        self.ws()
+
+    def _term(self, caps):
+        self.cap(caps, 'base_expression')
+        while self.optional_cap(caps, 'method_call') or self.optional_cap(caps, 'field_access') or self.optional_cap(caps, 'index_call'):
+            pass
+
+    def _place_term(self, caps):
+        self.cap(caps, 'base_expression')
+        while self.optional_cap(caps, 'field_access') or self.optional_cap(caps, 'index_call'):
+            pass
+
+    # Types of statements _____________________________________________________
+
+    def keyword(self, s):
+        self.need(s)
+        self.ws()
+
+    def _print_statement(self, caps):
+        self.keyword('print')
+        self.cap(caps, 'expression')
+        self.ws()
+
+        def another(inner):
+            self.need(',')
+            self.ws()
+            self.cap(inner, 'expression')
+            self.ws()
+        while self.group(caps, another):
+            pass
+        self.ws()
+
+    def declaration(self, caps):
+        self.cap(caps, 'identifier')
+        self.ws()
+
+        def explicit_type(inner):
+            self.need(':')
+            self.ws()
+            self.cap(inner, 'type')
+            self.ws()
+        self.group(caps, explicit_type)
+        self.ws()
+
+        if not self.lit('='):
+            self.error("Incorrect assignment operator.")
+        self.ws()
+        self.cap(caps, 'expression')
+        self.ws()
+
+    def _var_statement(self, caps):
+        self.keyword('var')
+        self.declaration(caps)
+
+    def _const_statement(self, caps):
+        self.keyword('const')
+        self.declaration(caps)
+
+    def _set_statement(self, caps):
+        self.keyword('set')
+        if not self.optional_cap(caps, 'place_term'):
+            self.cap(caps, 'identifier')
+        self.ws()
+
+        pos = self.pos
+        if self.lit(':') and self.try_ws() and (self.match('type') is not None) and self.try_ws():
+            self.error("'set' statement cannot be used with an explicit type, as the type of the variable is already assigned.")
+        self.pos = pos
+        self.ws()
+
+        self.cap(caps, 'assignment_op')
+        self.ws()
+        self.cap(caps, 'expression')
+        self.ws()
+
+    def _run_statement(self, caps):
+        self.keyword('run')
+        self.cap(caps, 'term')
+        self.ws()
+
+    def _return_statement(self, caps):
+        def with_value(inner):
+            self.keyword('return')
+            self.cap(inner, 'expression')
+            self.ws()
+        if not self.group(caps, with_value):
+            self.keyword('return')
+            if not self.at_line_end():
+                raise _NoMatch
+            self.ws()
+        self.ws()
+
+    def _break_statement(self, caps):
+        self.keyword('break')
+
+    def _continue_statement(self, caps):
+        self.keyword('continue')
+
+    def _exit_statement(self, caps):
+        self.keyword('exit')
+        self.cap(caps, 'int_literal')
+        self.ws()
+
+    # Blocks __________________________________________________________________
+
+    def conditional_block(self, caps, keyword):
+        # keyword <expression> <.separator>? '{' <.separator> <statements> '}'
+        self.keyword(keyword)
+        self.cap(caps, 'expression')
+        self.ws()
+        self.separator()
+        self.ws()
+        self.block(caps)
+
+    def _while_loop(self, caps):
+        self.conditional_block(caps, 'while')
+
+    def _for_loop(self, caps):
+        def body(inner):
+            self.separator()
+            self.ws()
+            self.block(inner)
+            self.ws()
+        def in_parens(inner):
+            self.keyword('for')
+            self.keyword('(')
+            self.cap(inner, 'identifier')
+            self.ws()
+            self.keyword('in')
+            self.cap(inner, 'expression')
+            self.ws()
+            self.keyword(')')
+            body(inner)
+        def in_bare(inner):
+            self.keyword('for')
+            self.cap(inner, 'identifier')
+            self.ws()
+            self.keyword('in')
+            self.cap(inner, 'expression')
+            self.ws()
+            body(inner)
+        def range_parens(inner):
+            self.keyword('for')
+            self.keyword('(')
+            self.cap(inner, 'identifier')
+            self.ws()
+            self.keyword('=')
+            self.cap(inner, 'expression')
+            self.ws()
+            self.keyword(';')
+            self.cap(inner, 'expression')
+            self.ws()
+            self.keyword(')')
+            body(inner)
+        def range_bare(inner):
+            self.keyword('for')
+            self.cap(inner, 'identifier')
+            self.ws()
+            self.keyword('=')
+            self.cap(inner, 'expression')
+            self.ws()
+            self.keyword(';')
+            self.cap(inner, 'expression')
+            self.ws()
+            body(inner)
+        if not (self.group(caps, in_parens) or self.group(caps, in_bare) or self.group(caps, range_parens) or self.group(caps, range_bare)):
+            raise _NoMatch
+        self.ws()
+
+    def _if_block(self, caps):
+        if not self.optional_cap(caps, 'if_branch'):
+            if self.match('elseif_branch') is not None:
+                self.error("'elseif' branch has no corresponding 'if' branch.")
+            if self.match('else_branch') is not None:
+                self.error("'else' branch has no corresponding 'if' branch.")
+            raise _NoMatch
+        self.ws()
+
+        def branch(name):
+            def f(inner):
+                self.separator()
+                self.ws()
+                self.cap(inner, name)
+                self.ws()
+            return f
+        while self.group(caps, branch('elseif_branch')):
+            pass
+        self.ws()
+        self.group(caps, branch('else_branch'))
+        self.ws()
+
+    def _if_branch(self, caps):
+        self.conditional_block(caps, 'if')
+
+    def _elseif_branch(self, caps):
+        self.conditional_block(caps, 'elseif')
+
+    def _else_branch(self, caps):
+        self.keyword('else')
+        self.separator()
+        self.ws()
+        self.block(caps)
+
+    def _match_block(self, caps):
+        self.keyword('match')
+        self.keyword('(')
+        self.cap(caps, 'expression')
+        self.ws()
+        self.keyword(')')
+        self.separator()
+        self.ws()
+        self.keyword('{')
+        self.need_separator()
+        self.ws()
+
+        def branch(inner):
+            self.cap(inner, 'match_branch')
+            self.ws()
+            self.need_separator()
+            self.ws()
+        if not self.group(caps, branch):
+            raise _NoMatch
+        while self.group(caps, branch):
+            pass
+        self.ws()
+        self.need('}')
+        self.ws()
+
+    def _match_branch(self, caps):
+        # The 'else' alternatives are tried first, since the Raku parser selects them by longest-token matching.
+        def conditions(inner):
+            self.cap(inner, 'expression')
+            self.ws()
+            def another(inner2):
+                self.need(',')
+                self.ws()
+                self.cap(inner2, 'expression')
+                self.ws()
+            while self.group(inner, another):
+                pass
+            self.ws()
+            self.keyword('->')
+        def else_block(inner):
+            self.keyword('else')
+            self.keyword('->')
+            self.block(inner)
+        def else_statement(inner):
+            self.keyword('else')
+            self.keyword('->')
+            self.cap(inner, 'statement')
+            self.ws()
+        def conditions_block(inner):
+            conditions(inner)
+            self.block(inner)
+        def conditions_statement(inner):
+            conditions(inner)
+            self.cap(inner, 'statement')
+            self.ws()
+        if not (self.group(caps, else_block) or self.group(caps, else_statement) or
+                self.group(caps, conditions_block) or self.group(caps, conditions_statement)):
+            raise _NoMatch
+        self.ws()
+
+
+def parse(text: str) -> dict:
+    # Returns the same tree as the Raku parser, as nested dicts
+    return Parser(text).parse()
+
+def parse_nodes(text: str) -> nodes.Node:
+    return Parser(text, make_node=nodes.Node.make).parse()
+
+def format_yaml(tree: dict, n_indent: int = 0) -> str:
+    # Same format as print_parsed in parser.raku, for the -p option
+    r = ''
+    for name, data in tree.items():
+        r += '\n' + '  ' * n_indent + '- ' + name + ': '
+        if isinstance(data, list):
+            for x in data:
+                r += format_yaml(x, n_indent + 1)
+        elif isinstance(data, int):
+            r += str(data)
+        else:
+            r += "'" + data.replace("'", "''") + "'"
+    return r
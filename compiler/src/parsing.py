@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import re
+import subprocess
+import threading
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+from src.common import *
+from src.cache import DiskCache, hash_bytes
+from src.nodes import Node
+from src import parser, timing
+
+# Directory of /serene/compiler/
+compiler_dir = Path(__file__).parent.resolve().parent
+
+# Either 'raku', which runs parser.raku in a subprocess, or 'python', which uses the equivalent parser in parser.py
+backend = 'raku'
+
+# If False, every file is parsed with a separate one-shot Raku process
+use_server = True
+
+# Maximum number of files that are parsed at the same time
+max_workers = min(8, os.cpu_count() or 1)
+
+# Parse trees from the Raku parser are cached by the hash of the file contents and of the parser, so that unchanged files (such as modules
+# shared by many programs) are not parsed again. The cache directory can be changed with the SERENE_CACHE_DIR
+# environment variable. If use_cache is False, the cache is neither read nor written.
+use_cache = True
+cache_dir = Path(os.environ.get('SERENE_CACHE_DIR', compiler_dir / 'temp' / 'cache'))
+parse_cache = DiskCache(cache_dir / 'parse', max_size=64 * 1024 * 1024, suffix='.json')
+
+parser_hash = None
+
+# In watch mode, the parse tree of each file is kept in memory as a dict, along with the file's modification time and
+# size when it was parsed, so that only files that have changed are parsed again. Syntax errors are kept in the same way.
+# If tree_memo is None, files are always parsed.
+tree_memo: dict[Path, tuple[tuple[int, int] | None, dict | SereneSyntaxError]] | None = None
+
+# Parses that were started ahead of time by prefetch_includes, by canonical path. parse_file uses (and removes) the
+# result instead of parsing the file again.
+prefetched: dict[Path, Future] = {}
+prefetch_lock = threading.Lock()
+include_pattern = re.compile(r'^[ \t]*include[ \t]+(\S+)', re.MULTILINE)
+
+
+class ParserServerError(Exception):
+    pass
+
+class ParserServer:
+    # Long-running 'raku src/parser.raku --server' process. Starting Rakudo and compiling the grammar takes much longer
+    # than parsing a typical file, so this process is started once and reused for the main file and all of its includes.
+    # Requests are absolute file paths, one per line. Each response is a header line "OK <length>" or "ERR <length>",
+    # followed by <length> bytes containing either the parse tree (as JSON) or the error message.
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.process = subprocess.Popen(['raku', 'src/parser.raku', '--server', '--json'], cwd=compiler_dir,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def request(self, source_path: Path):
+        try:
+            # Starting the server fails with an OSError if raku is not installed
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            self.process.stdin.write((str(source_path) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+
+            header = self.process.stdout.readline().decode('utf-8').split()
+            if len(header) != 2 or header[0] not in ('OK', 'ERR') or not header[1].isdigit():
+                raise ParserServerError(f"Invalid response header from parser server: {header}")
+            body = self.process.stdout.read(int(header[1]))
+            if len(body) != int(header[1]):
+                raise ParserServerError("Parser server exited while sending a response.")
+        except (OSError, ParserServerError):
+            if self.process is not None:
+                self.process.kill()
+                self.process.wait()
+                self.process = None
+            raise ParserServerError("Parser server crashed.")
+
+        return (header[0] == 'OK'), body.decode('utf-8')
+
+    def parse(self, source_path: Path):
+        # If the server has crashed, it is restarted once before giving up
+        with self.lock:
+            try:
+                return self.request(source_path)
+            except ParserServerError:
+                return self.request(source_path)
+
+class ParserServerPool:
+    # Idle servers are reused, and a new server is started whenever all of the existing ones are busy, so that several
+    # files can be parsed at the same time. The number of servers is bounded by the number of threads calling parse().
+    def __init__(self):
+        self.servers = []
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def parse(self, source_path: Path):
+        with self.lock:
+            if self.idle:
+                server = self.idle.pop()
+            else:
+                server = ParserServer()
+                self.servers.append(server)
+        try:
+            return server.parse(source_path)
+        finally:
+            with self.lock:
+                self.idle.append(server)
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+servers = ParserServerPool()
+atexit.register(servers.stop)
+
+
+def parse_once(source_path: Path, as_json: bool = True) -> str:
+    command = ['raku', 'src/parser.raku', '--json', source_path] if as_json else ['raku', 'src/parser.raku', source_path]
+    completed_process = subprocess.run(command, cwd=compiler_dir, capture_output=True, text=True)
+    if completed_process.returncode == 0:
+        printerr(completed_process.stderr, end='')
+        return completed_process.stdout
+    else:
+        raise SereneSyntaxError(completed_process.stderr)
+
+def parse_file_yaml(source_path: Path) -> str:
+    # Returns the parse tree as human-readable YAML, for the -p option
+    if backend == 'python':
+        return parser.format_yaml(parse_with_python(source_path, parser.parse)) + '\n'
+    return parse_once(source_path, as_json=False)
+
+def cache_key(source_path: Path) -> str | None:
+    global parser_hash
+    try:
+        if parser_hash is None:
+            parser_hash = hash_bytes((compiler_dir / 'src' / 'parser.raku').read_bytes())
+        return hash_bytes(parser_hash.encode('utf-8'), source_path.read_bytes())
+    except OSError:
+        return None
+
+def read_source(source_path: Path) -> str:
+    try:
+        return source_path.read_text(encoding='utf-8')
+    except (OSError, UnicodeDecodeError) as exc:
+        raise SereneSyntaxError(f"Error reading file {source_path}: {exc}\n")
+
+def parse_file(source_path: Path) -> Node:
+    # Returns the parse tree of a Serene source file as a 'definitions' node, or raises SereneSyntaxError
+    with prefetch_lock:
+        future = prefetched.pop(source_path, None)
+    if future is not None:
+        return future.result()
+    return parse_source(source_path)
+
+@contextmanager
+def prefetch_includes(source_path: Path, executor: Executor):
+    # Finds the files that a file includes with a quick scan of its text, and starts parsing them on the executor, so
+    # that they are parsed at the same time as the file itself. The scan doesn't need to be exact, since a file that
+    # turns out not to be included is just never used. Parses that haven't been used are discarded at the end of the
+    # 'with' block.
+    futures = {}
+    try:
+        text = source_path.read_text(encoding='utf-8')
+    except (OSError, UnicodeDecodeError):
+        text = ''
+    with prefetch_lock:
+        for match in include_pattern.finditer(text):
+            path = (source_path.parent / match[1]).resolve()
+            if path.is_file() and path not in prefetched:
+                futures[path] = prefetched[path] = executor.submit(timing.propagate(parse_source), path)
+    try:
+        yield
+    finally:
+        with prefetch_lock:
+            for path, future in futures.items():
+                if prefetched.get(path) is future:
+                    del prefetched[path]
+
+def file_stamp(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def parse_source(source_path: Path) -> Node:
+    if tree_memo is not None:
+        return parse_memoized(source_path)
+    if backend == 'python':
+        with timing.phase('parse (Python parser)'):
+            return parse_with_python(source_path, parser.parse_nodes)
+    tree = parse_with_raku(source_path)
+    with timing.phase('Node.create'):
+        return Node.create(tree)
+
+def parse_memoized(source_path: Path) -> Node:
+    stamp = file_stamp(source_path)
+    entry = tree_memo.get(source_path)
+    if entry is None or entry[0] != stamp:
+        try:
+            if backend == 'python':
+                with timing.phase('parse (Python parser)'):
+                    result = parse_with_python(source_path, parser.parse)
+            else:
+                result = parse_with_raku(source_path)
+        except SereneSyntaxError as exc:
+            result = exc
+        entry = tree_memo[source_path] = (stamp, result)
+
+    if isinstance(entry[1], SereneSyntaxError):
+        raise entry[1]
+    with timing.phase('Node.create'):
+        return Node.create(entry[1])
+
+def parse_with_python(source_path: Path, parse: Callable[[str], Any]):
+    try:
+        return parse(read_source(source_path))
+    except SereneSyntaxError as exc:
+        # Same as the error output of parser.raku, which ends with an extra newline
+        raise SereneSyntaxError(exc.message + '\n')
+
+def parse_with_raku(source_path: Path) -> dict:
+    key = cache_key(source_path) if use_cache else None
+    if key is not None:
+        with timing.phase('parse cache lookup'):
+            cached = parse_cache.get(key)
+        if cached is not None:
+            try:
+                with timing.phase('JSON load'):
+                    return json.loads(cached)[0]
+            except (ValueError, IndexError):
+                pass    # Corrupted cache entry, which is replaced below
+
+    with timing.phase('parse (Raku parser)'):
+        text = parse_text(source_path)
+    try:
+        with timing.phase('JSON load'):
+            tree = json.loads(text)[0]
+    except (ValueError, IndexError) as exc:
+        raise SereneSyntaxError(f"Invalid parse tree received from parser: {exc}\n")
+
+    if key is not None:
+        parse_cache.put(key, text.encode('utf-8'), evict=False)
+    return tree
+
+def finish():
+    # Called once the main file and all of its includes have been parsed, so that the cache is only evicted once for
+    # each compilation, rather than for every file
+    if use_cache:
+        parse_cache.evict()
+
+def parse_text(source_path: Path) -> str:
+    global use_server
+
+    if use_server and '\n' not in str(source_path):
+        try:
+            success, output = servers.parse(source_path)
+        except ParserServerError as exc:
+            printerr(f"{exc} Falling back to one-shot parsing.")
+            use_server = False
+        else:
+            if success:
+                return output
+            else:
+                raise SereneSyntaxError(output)
+    return parse_once(source_path)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import shlex
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from src import parsing
+from src.cache import hash_bytes
+
+# Used by the --pgo option. The program is first built with -fprofile-generate, and the training command is run, which
+# writes profile data (.gcda files) next to the object files in the build directory. The profile data is saved in
+# profile_dir, under a key that depends on the C++ code, the g++ flags, and the number of translation units, and the
+# program is built again with -fprofile-use. Later builds of the same code with the same flags find the saved profile
+# data, copy it into their own build directory, and build with -fprofile-use as well.
+profile_dir = parsing.cache_dir / 'pgo'
+
+
+def profile_key(cpp_code: str, build_inputs: bytes, n_units: int) -> str:
+    return hash_bytes(cpp_code.encode(), build_inputs, str(n_units).encode())
+
+def saved_profile(key: str) -> list[Path]:
+    try:
+        return sorted((profile_dir / key).glob('*.gcda'))
+    except OSError:
+        return []
+
+def profile_hash(key: str) -> str | None:
+    # Identifies the saved profile data for a key, since it changes whenever the program is trained again
+    files = saved_profile(key)
+    if len(files) == 0:
+        return None
+    return hash_bytes(*(part for x in files for part in (x.name.encode(), x.read_bytes())))
+
+def save_profile(key: str, build_dir: Path):
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    # Copied to a temporary directory first, so that concurrent builds never see a partial set of files
+    temp_dir = Path(tempfile.mkdtemp(dir=profile_dir, prefix='.tmp-'))
+    for x in build_dir.glob('*.gcda'):
+        shutil.copy2(x, temp_dir / x.name)
+    shutil.rmtree(profile_dir / key, ignore_errors=True)
+    try:
+        temp_dir.rename(profile_dir / key)
+    except OSError:
+        # Another build saved profile data for the same key in the meantime
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def restore_profile(key: str, build_dir: Path):
+    for x in saved_profile(key):
+        shutil.copy2(x, build_dir / x.name)
+
+def train(command: str, executable_path: Path) -> int:
+    # Runs the training command in a shell, with {binary} replaced by the path of the instrumented executable. A command
+    # without {binary} is treated as arguments for the executable. Returns the exit code.
+    if '{binary}' not in command:
+        command = '{binary} ' + command
+    return subprocess.run(command.replace('{binary}', shlex.quote(str(executable_path))), shell=True).returncode
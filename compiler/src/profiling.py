@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import cProfile
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.common import *
+
+# Used by the --profile option. If output_dir is set, each compilation (through driver.compile_to_cpp) is run
+# under cProfile, and its call stack is also sampled periodically from another thread. For each source file, two files
+# are written to output_dir: <name>.pstats, which can be read with pstats or snakeviz, and <name>.collapsed, which has
+# one line per unique stack ("outer;inner;innermost count") and can be read by flamegraph.pl, speedscope, or inferno.
+output_dir: Path | None = None
+sample_interval = 0.001     # Seconds
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, output_path: Path):
+        with open(output_path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile(name: str):
+    # Profiles the code inside the 'with' block, if profiling is enabled
+    if output_dir is None:
+        yield
+        return
+
+    # The sampler thread can only run when the compiling thread releases the GIL, which by default happens every 5 ms
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, sample_interval / 2))
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), sample_interval)
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        sys.setswitchinterval(switch_interval)
+        pstats_path = output_dir / (name + '.pstats')
+        collapsed_path = output_dir / (name + '.collapsed')
+        profiler.dump_stats(pstats_path)
+        sampler.write(collapsed_path)
+        printerr("Saved profile to files", pstats_path, "and", collapsed_path)
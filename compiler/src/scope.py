@@ -1,13 +1,16 @@
 from __future__ import annotations
 
-from src.common import *
+import sys
+import threading
+import types
+from contextlib import contextmanager
 
-line_number = 1
+from src.common import *
 
 class VariableObject:
     def __init__(self, name, mutable, var_type, is_field = False, is_self = False):
         if (not is_self) and (name == 'self'):
-            raise SereneScopeError(f"Variable cannot be named 'self', at line number {line_number}.")
+            raise SereneScopeError(f"Variable cannot be named 'self', at line number {get_context().line_number}.")
         self.name = name
         self.mutable = mutable
         self.var_type = var_type
@@ -23,7 +26,7 @@ class VariableObject:
 class ParameterObject:
     def __init__(self, name, accessor, var_type, generic=False):
         if (name == 'self'):
-            raise SereneScopeError(f"Parameter cannot be named 'self', at line number {line_number}.")
+            raise SereneScopeError(f"Parameter cannot be named 'self', at line number {get_context().line_number}.")
         self.name = name
         self.accessor = accessor
         self.var_type = var_type
@@ -48,8 +51,7 @@ class ScopeObject:
 
         # Only used for the scopes of generic functions; stores TypeParameterObject objects
         self.type_parameters = dict()
-        self.generic_combos_params = []
-        self.generic_combos_type_params = []
+        self.instantiations = dict()    # Maps a tuple of the parameter types of each instantiation to its type parameters
         self.generic_combos_params_temp = None
         self.generic_combos_type_params_temp = None
 
@@ -68,19 +70,19 @@ class ScopeObject:
 
     def add_binding(self, binding_object):
         if self.check_read(binding_object.name):
-            raise SereneScopeError(f"Variable '{binding_object.name}' defined at line {line_number} already exists in this scope.")
+            raise SereneScopeError(f"Variable '{binding_object.name}' defined at line {get_context().line_number} already exists in this scope.")
         self.bindings[binding_object.name] = binding_object
 
     def add_persistent_binding(self, binding_object):
         if binding_object.name in self:
-            raise SereneScopeError(f"Variable '{binding_object.name}' defined at line {line_number} already exists in this scope.")
+            raise SereneScopeError(f"Variable '{binding_object.name}' defined at line {get_context().line_number} already exists in this scope.")
         self.persistent_bindings[binding_object.name] = binding_object
         self.bindings[binding_object.name] = binding_object
     
     def kill_binding(self, name):
         if name in self:
-            if current_scope.loop:
-                raise SereneScopeError(f"Variable '{name}' is moved or destroyed at line {line_number} in a loop where it may be accessed again.")
+            if get_context().current_scope.loop:
+                raise SereneScopeError(f"Variable '{name}' is moved or destroyed at line {get_context().line_number} in a loop where it may be accessed again.")
             del self.bindings[name]
         else:
             raise ValueError
@@ -109,25 +111,28 @@ class ScopeObject:
             return False
     
     def check_set(self, name):
+        top_scope = get_context().top_scope
         cur = self
         while cur != top_scope:
             if (name in cur):
                 if type(cur[name]) == VariableObject:
                     if not cur[name].mutable:
-                        raise SereneScopeError(f"Cannot mutate a const identifier, at line number {line_number}.")
+                        raise SereneScopeError(f"Cannot mutate a const identifier, at line number {get_context().line_number}.")
                     if (cur[name].is_field or cur[name].is_self) and self.nonmut_method:
-                        raise SereneScopeError(f"Cannot mutate 'self' or its fields in a non-mutating method, at line number {line_number}.")
+                        raise SereneScopeError(f"Cannot mutate 'self' or its fields in a non-mutating method, at line number {get_context().line_number}.")
                     return
                 elif type(cur[name]) == ParameterObject:
                     if cur[name].accessor == 'look':
-                        raise SereneScopeError(f"Cannot mutate a 'look' parameter, at line number {line_number}.")
+                        raise SereneScopeError(f"Cannot mutate a 'look' parameter, at line number {get_context().line_number}.")
                     return
             else:
                 cur = cur.parent
-        raise SereneScopeError(f"Variable {name} is not defined at line number {line_number}.")
+        raise SereneScopeError(f"Variable {name} is not defined at line number {get_context().line_number}.")
 
     def add_access(self, var_tup, accessor):    # var_tup is (var_name, field_name1, field_name2, ...)
         var_name = var_tup[0]
+        top_scope = get_context().top_scope
+        current_enclosure = get_context().current_enclosure
         cur = self
         while cur != top_scope:
             if (var_name in cur):
@@ -135,7 +140,7 @@ class ScopeObject:
                 break
             cur = cur.parent
         else:
-            raise SereneScopeError(f"Variable {var_name} is not defined at line number {line_number}.")
+            raise SereneScopeError(f"Variable {var_name} is not defined at line number {get_context().line_number}.")
 
         output = (binding_object,) + tuple(x for x in var_tup[1:])
         
@@ -152,6 +157,9 @@ class ScopeObject:
             min_len = min(len(A), len(B))
             return A[:min_len] == B[:min_len]
 
+        top_scope = get_context().top_scope
+        current_enclosure = get_context().current_enclosure
+
         # printerr("Line:", line_number)
         # printerr("READ:", current_enclosure.read_list)
         # printerr("WRITE:", current_enclosure.write_list)
@@ -161,12 +169,12 @@ class ScopeObject:
         for x in current_enclosure.write_list:
             if type(x[0]) == VariableObject:
                 if not x[0].mutable:
-                    raise SereneScopeError(f"Cannot mutate a const identifier, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot mutate a const identifier, at line number {get_context().line_number}.")
                 if (x[0].is_field or x[0].is_self) and self.nonmut_method:
-                    raise SereneScopeError(f"Cannot mutate 'self' or its fields in a non-mutating method, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot mutate 'self' or its fields in a non-mutating method, at line number {get_context().line_number}.")
             elif type(x[0]) == ParameterObject:
                 if x[0].accessor == 'look':
-                    raise SereneScopeError(f"Cannot mutate a 'look' parameter, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot mutate a 'look' parameter, at line number {get_context().line_number}.")
             else:
                 raise ValueError
             
@@ -177,7 +185,7 @@ class ScopeObject:
                         conflicting_path = x[0].name + '.' + '.'.join(x[1:min_len])
                     else:
                         conflicting_path = x[0].name
-                    raise SereneScopeError(f"Cannot mutate '{conflicting_path}' that is also read in the same statement, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot mutate '{conflicting_path}' that is also read in the same statement, at line number {get_context().line_number}.")
         
         while len(current_enclosure.write_list) > 0:
             x = current_enclosure.write_list.pop()
@@ -188,20 +196,20 @@ class ScopeObject:
                         conflicting_path = x[0].name + '.' + '.'.join(x[1:min_len])
                     else:
                         conflicting_path = x[0].name
-                    raise SereneScopeError(f"Cannot mutate '{conflicting_path}' multiple times in single statement, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot mutate '{conflicting_path}' multiple times in single statement, at line number {get_context().line_number}.")
         
         for x in current_enclosure.delete_list:
             if len(x) > 1 or ((type(x[0]) == VariableObject) and (x[0].is_field)):
-                raise SereneScopeError(f"Struct fields cannot be moved, at line number {line_number}.")
+                raise SereneScopeError(f"Struct fields cannot be moved, at line number {get_context().line_number}.")
             
             if type(x[0]) == VariableObject:
                 if not x[0].mutable:
-                    raise SereneScopeError(f"Cannot move a const identifier, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot move a const identifier, at line number {get_context().line_number}.")
             elif type(x[0]) == ParameterObject:
                 if x[0].accessor == 'look':
-                    raise SereneScopeError(f"Cannot move a 'look' parameter, at line number {line_number}.")
+                    raise SereneScopeError(f"Cannot move a 'look' parameter, at line number {get_context().line_number}.")
                 if x[0].accessor == 'mutate':
-                    raise SereneScopeError(f"Cannot move a 'mutate' parameter, at line number {line_number}.")               
+                    raise SereneScopeError(f"Cannot move a 'mutate' parameter, at line number {get_context().line_number}.")               
             else:
                 raise ValueError
             
@@ -214,7 +222,7 @@ class ScopeObject:
                     break
                 cur = cur.parent
             else:
-                raise SereneScopeError(f"Variable {x[0].name} is not defined at line number {line_number}.")
+                raise SereneScopeError(f"Variable {x[0].name} is not defined at line number {get_context().line_number}.")
 
     # def check_return(self, name):   # Not currently used?
     #     if (name in self):
@@ -232,15 +240,87 @@ class ScopeObject:
     #         return False
 
 
-top_scope = ScopeObject(None)
-current_scope = top_scope
-scope_for_setup = None
-current_statement = None
-current_enclosure = None
-current_func_type = None
-current_type_params = None
-loops: list = []
-functions = None
-function_names: list[str] = []
-definitions = None
-remaining_generic_functions: list[tuple] = []
+def add_instantiation(function, params, type_params) -> bool:
+    # Called for every instantiation of a generic function that is requested. Adds the instantiation and queues its code
+    # to be generated, unless the function has already been instantiated with the same parameter types. Returns whether
+    # the instantiation is new.
+    context = get_context()
+    context.requested_instantiations.append((function, params, type_params))
+    instantiations = function.my_scope.instantiations
+    key = tuple(params)
+    if key in instantiations:
+        return False
+    if context.max_instantiations is not None and len(instantiations) >= context.max_instantiations:
+        raise SereneCompileError(f"Generic function '{function.get_scalar(Symbol.identifier)}' is instantiated with more than {context.max_instantiations} "
+                                 f"combinations of types at line number {context.line_number}.")
+    instantiations[key] = type_params
+    context.remaining_generic_functions.append((function, list(params), type_params))
+    return True
+
+def instantiation_counts() -> dict[str, int]:
+    # Number of instantiations of each generic function in the current compilation
+    return {x.get_scalar(Symbol.identifier): len(x.my_scope.instantiations) for x in get_context().functions if x.generic}
+
+
+class CompilationContext:
+    # All of the state of a single compilation. Each thread has its own current context, and the attributes of the
+    # context can be accessed as attributes of this module (e.g. scope.current_scope), so a new context is all that is
+    # needed to compile another program in the same process, either afterwards or concurrently on another thread.
+    def __init__(self, options=None):
+        # Settings from a compile.CompileOptions (or the defaults, if options is None)
+        self.max_instantiations = options.max_instantiations if options is not None else None
+        self.report_instantiations = options.report_instantiations if options is not None else False
+
+        self.line_number = 1
+        self.top_scope = ScopeObject(None)
+        self.current_scope = self.top_scope
+        self.scope_for_setup = None
+        self.current_statement = None
+        self.current_enclosure = None
+        self.current_func_type = None
+        self.current_type_params = None
+        self.type_generation = 0                # Changes whenever the types cached in expression nodes become invalid
+        self.loops: list = []
+        self.functions = None
+        self.function_names: list[str] = []
+        self.functions_by_name: dict = {}       # Maps function names to their FunctionNode
+        self.definitions = None
+        self.remaining_generic_functions: list[tuple] = []
+        self.requested_instantiations: list[tuple] = []     # Includes ones that already exist, for the codegen cache
+        self.user_defined_types: dict = {}      # Maps struct names to their TypeSpecification
+        self.indent_level = 0                   # Indentation of the generated C++ code
+
+context_attributes = frozenset(vars(CompilationContext()))
+
+local = threading.local()
+
+def get_context() -> CompilationContext:
+    # If no context has been set up for this thread, a new one is created
+    context = getattr(local, 'context', None)
+    if context is None:
+        context = local.context = CompilationContext()
+    return context
+
+@contextmanager
+def use_context(context: CompilationContext):
+    previous = getattr(local, 'context', None)
+    local.context = context
+    try:
+        yield context
+    finally:
+        local.context = previous
+
+class ScopeModule(types.ModuleType):
+    def __getattr__(self, name):
+        # Only called for names that are not defined in the module itself
+        if name in context_attributes:
+            return getattr(get_context(), name)
+        raise AttributeError(f"module '{self.__name__}' has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        if name in context_attributes:
+            setattr(get_context(), name, value)
+        else:
+            super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = ScopeModule
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Records the wall time and CPU time of each phase of a compilation, for the --time-phases option. The timer that is
+# currently active is stored per thread, so that the phases can be marked anywhere in the compiler with
+# 'with timing.phase(...)', which does nothing when no timer is active.
+#
+# CPU time is the CPU time of the current thread plus that of any child processes that finished during the phase (such
+# as one-shot Raku parsers and g++). The CPU time of a parser server is not included, since the server is still running.
+
+categories = ('phase', 'function', 'generic', 'struct')
+category_titles = {'phase':    'Phase',
+                   'function': 'Function code generation',
+                   'generic':  'Generic instantiation',
+                   'struct':   'Struct code generation'}
+
+
+class Record:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+class PhaseTimer:
+    def __init__(self):
+        # Maps (category, name) to a Record, in the order that the phases were first entered
+        self.records: dict[tuple[str, str], Record] = {}
+        self.lock = threading.Lock()
+        self.start_wall = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, category: str = 'phase'):
+        start_wall = time.perf_counter()
+        start_cpu = cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = cpu_time() - start_cpu
+            with self.lock:
+                record = self.records.setdefault((category, name), Record())
+                record.count += 1
+                record.wall += wall
+                record.cpu += cpu
+
+    def to_json(self) -> dict:
+        output = {'total_wall': time.perf_counter() - self.start_wall}
+        for category in categories:
+            output[category] = [{'name': name, 'count': record.count, 'wall': record.wall, 'cpu': record.cpu}
+                                for (c, name), record in self.records.items() if c == category]
+        return output
+
+    def report(self) -> str:
+        # Phases are listed in the order they ran, and functions, instantiations, and structs from slowest to fastest
+        lines = []
+        for category in categories:
+            rows = [(name, record) for (c, name), record in self.records.items() if c == category]
+            if len(rows) == 0:
+                continue
+            if category != 'phase':
+                rows.sort(key=lambda x: x[1].wall, reverse=True)
+            width = max(40, max(len(name) for name, _ in rows) + 2)
+            lines.append(f"{category_titles[category]:<{width}}{'Count':>8}{'Wall (ms)':>12}{'CPU (ms)':>12}")
+            for name, record in rows:
+                lines.append(f"{name:<{width}}{record.count:>8}{record.wall * 1000:>12.2f}{record.cpu * 1000:>12.2f}")
+            lines.append('')
+        lines.append(f"Total wall time: {(time.perf_counter() - self.start_wall) * 1000:.2f} ms")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_path):
+        with open(output_path, 'w') as file:
+            json.dump(self.to_json(), file, indent=4)
+
+
+def cpu_time() -> float:
+    times = os.times()
+    return time.thread_time() + times.children_user + times.children_system
+
+local = threading.local()
+
+def current_timer() -> PhaseTimer | None:
+    return getattr(local, 'timer', None)
+
+def set_timer(timer: PhaseTimer | None):
+    local.timer = timer
+
+@contextmanager
+def use_timer(timer: PhaseTimer | None):
+    previous = current_timer()
+    set_timer(timer)
+    try:
+        yield timer
+    finally:
+        set_timer(previous)
+
+def phase(name: str, category: str = 'phase'):
+    timer = current_timer()
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name, category)
+
+def propagate(func):
+    # Wraps a function that is run on another thread (e.g. by a thread pool), so that it uses the current thread's timer
+    timer = current_timer()
+    def wrapper(*args, **kwargs):
+        with use_timer(timer):
+            return func(*args, **kwargs)
+    return wrapper
@@ -11,19 +11,40 @@ class TypeSpecification:
         self.constructor_params = constructor_params
 
 class TypeObject:
-    def __init__(self, base: str, params: list[TypeObject] | None = None, allow_partial=False):
-        self.base = base
-        self.params = params
-        assert type(self.base) == str
-        if self.base in ('Vector', 'Array') and not allow_partial:
-            assert self.params is not None
-    
-    def __eq__(self, other):
-        if isinstance(other, TypeObject):
-            return (self.base == other.base) and (self.params == other.params)
-        else:
-            raise TypeError
-    
+    # Types are interned: TypeObject(base, params) returns the same instance for the same base and parameters, so two
+    # types are equal only if they are the same object, and they can be used as dict keys. Instances are immutable.
+    __slots__ = ('base', 'params')
+    interned: dict[tuple[str, tuple[TypeObject, ...] | None], TypeObject] = {}
+
+    def __new__(cls, base: str, params: list[TypeObject] | tuple[TypeObject, ...] | None = None, allow_partial=False):
+        assert type(base) == str
+        if base in ('Vector', 'Array') and not allow_partial:
+            assert params is not None
+        key = (base, None if params is None else tuple(params))
+        self = cls.interned.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            object.__setattr__(self, 'base', key[0])
+            object.__setattr__(self, 'params', key[1])
+            # setdefault, so that threads creating the same type at the same time still get the same instance
+            self = cls.interned.setdefault(key, self)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TypeObject is immutable, so '{name}' cannot be set.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"TypeObject is immutable, so '{name}' cannot be deleted.")
+
+    def __reduce__(self):
+        return (TypeObject, (self.base, self.params, True))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
     def __repr__(self):
         if self.params is None:
             return self.base
@@ -54,5 +75,3 @@ standard_types = {'Vector': TypeSpecification(members={},
                   'File': TypeSpecification(members={},
                                             methods={"to_string": (TypeObject("String"), [])})
                  }
-
-user_defined_types: dict[str, TypeSpecification] = {}
@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Allows the tests to import the compiler as 'src', the same way the serene script does
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+
+from src import build, driver, incremental, parsing, pgo
+from src.cache import DiskCache
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path_factory, monkeypatch):
+    # Each test gets empty caches, so that tests don't depend on or fill up the caches of the compiler directory
+    cache_dir = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('SERENE_CACHE_DIR', str(cache_dir))     # For compilers started as separate processes
+    monkeypatch.setattr(parsing, 'parse_cache', DiskCache(cache_dir / 'parse', parsing.parse_cache.max_size, '.json'))
+    monkeypatch.setattr(incremental, 'codegen_cache', DiskCache(cache_dir / 'codegen', incremental.codegen_cache.max_size, '.json'))
+    monkeypatch.setattr(driver, 'binary_cache', DiskCache(cache_dir / 'binaries', driver.binary_cache.max_size))
+    monkeypatch.setattr(driver, 'object_cache', DiskCache(cache_dir / 'objects', driver.object_cache.max_size, '.o'))
+    monkeypatch.setattr(pgo, 'profile_dir', cache_dir / 'pgo')
+    monkeypatch.setattr(build, 'pch_dir', cache_dir / 'pch')
+    monkeypatch.setattr(build, 'pch_cache', DiskCache(build.pch_dir / 'serene_runtime.hh.gch', build.pch_cache.max_size, '.gch'))
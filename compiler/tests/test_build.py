@@ -0,0 +1,78 @@
+import argparse
+import shutil
+import subprocess
+
+import pytest
+
+from src import build
+from src.build import BuildConfig
+from src.cache import DiskCache
+
+include_flags = ['-I', str(build.lib_dir)]
+
+
+def parse_args(*args):
+    parser = argparse.ArgumentParser()
+    build.add_arguments(parser)
+    return BuildConfig.from_args(parser.parse_args(args))
+
+def test_default_flags_are_unoptimized():
+    assert parse_args().flags() == ['-std=c++17'] + include_flags + ['-O0']
+
+def test_profiles_and_overrides():
+    assert parse_args('--release').flags() == ['-std=c++17'] + include_flags + ['-O2', '-flto', '-DNDEBUG']
+    assert '-march=native' in parse_args('--build-profile', 'native').flags()
+
+    # The optimization level and extra flags come after the profile's flags, so they take precedence
+    flags = parse_args('--release', '-O3', '--cxx-flags=-Wall -g', '--cxx-flags=-fno-lto').flags()
+    assert flags == ['-std=c++17'] + include_flags + ['-O2', '-flto', '-DNDEBUG', '-O3', '-Wall', '-g', '-fno-lto']
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='g++ is not installed')
+def test_precompiled_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, 'pch_dir', tmp_path)
+    monkeypatch.setattr(build, 'pch_cache', DiskCache(tmp_path / 'serene_runtime.hh.gch', build.pch_cache.max_size, '.gch'))
+    config = BuildConfig()
+
+    pch_flags = build.precompile_header(config)
+    assert pch_flags == ['-I', str(tmp_path)]
+    [pch_path] = build.pch_cache.directory.iterdir()
+    assert build.precompile_header(config) == pch_flags
+    assert list(build.pch_cache.directory.iterdir()) == [pch_path]
+
+    # g++ -H marks the precompiled headers that it uses with '!'
+    program = tmp_path / 'program.cc'
+    program.write_text('#include "serene_runtime.hh"\nint main() { return 0; }\n')
+    completed_process = subprocess.run(['g++'] + pch_flags + config.flags() + ['-H', '-fsyntax-only', str(program)], capture_output=True, text=True)
+    assert completed_process.returncode == 0
+    assert f"! {pch_path}" in completed_process.stderr
+
+    # Another configuration gets its own precompiled header, but one for an older version of the headers is deleted
+    build.precompile_header(BuildConfig('debug', '1'))
+    assert len(list(build.pch_cache.directory.iterdir())) == 2
+    # Temporary files might still be written by another process, so they are not deleted
+    (build.pch_cache.directory / '.tmp-other.gch').touch()
+    monkeypatch.setattr(build, 'headers_hash', lambda: 'f' * 64)
+    build.precompile_header(config)
+    assert sorted(x.name[:16] for x in build.pch_cache.directory.iterdir()) == ['.tmp-other.gch', 'f' * 16]
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='g++ is not installed')
+def test_pch_falls_back_if_it_cannot_be_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, 'pch_dir', tmp_path)
+    monkeypatch.setattr(build, 'pch_cache', DiskCache(tmp_path / 'serene_runtime.hh.gch', build.pch_cache.max_size, '.gch'))
+    def replace(source, destination):
+        raise PermissionError(destination)
+    monkeypatch.setattr(build.os, 'replace', replace)
+
+    assert build.precompile_header(BuildConfig()) == []
+    assert list(build.pch_cache.directory.iterdir()) == []
+    assert [x for x in tmp_path.iterdir() if x.name.startswith('.tmp-')] == []
+
+def test_pch_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(build, 'use_pch', False)
+    assert build.precompile_header(BuildConfig()) == []
+
+def test_pgo_builds_are_optimized_by_default():
+    assert parse_args('--pgo').profile == 'release'
+    assert parse_args('--pgo={binary} input.txt').pgo_command == '{binary} input.txt'
+    assert parse_args('--pgo', '--build-profile', 'native').profile == 'native'
+    assert parse_args().pgo_command is None
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from src import compile, incremental, nodes, parsing
+from src.common import SereneError, SereneCompileError
+
+tests_dir = Path(__file__).parent.resolve()
+# t23 and t37 use features that are not supported yet
+programs = [path for path in sorted(tests_dir.glob('t*.sn')) if path.stem not in ('t23', 't37')]
+
+
+@pytest.fixture(autouse=True)
+def python_parser(monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+    # Without the codegen cache, so that every compile generates all of its code
+    monkeypatch.setattr(incremental, 'use_cache', False)
+
+def compile_file(path):
+    return compile.main(parsing.parse_file(path), include_path=path.parent, source_path=path)
+
+def test_repeated_and_concurrent_compiles_are_independent():
+    first = [compile_file(path) for path in programs]
+    second = [compile_file(path) for path in programs]
+    assert first == second
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        concurrent = list(executor.map(compile_file, programs))
+    assert concurrent == first
+
+def test_errors_are_raised(tmp_path):
+    path = tmp_path / 'no_main.sn'
+    path.write_text("function other() {\n    print 1\n}\n")
+    with pytest.raises(SereneCompileError) as exc_info:
+        compile_file(path)
+    assert exc_info.value.report() == "COMPILE ERROR:\nNo 'main()' function is defined.\n"
+
+    # The failed compile doesn't affect the next one
+    assert compile_file(tests_dir / 't1.sn') == compile_file(tests_dir / 't1.sn')
+
+@pytest.mark.parametrize('path', sorted(tests_dir.glob('p*.sn')), ids=lambda path: path.name)
+def test_invalid_programs_raise_serene_errors(path):
+    # Each of these is either invalid or compiles successfully; none of them should crash the compiler
+    try:
+        compile_file(path)
+    except SereneError as exc:
+        assert exc.report().startswith("COMPILE ERROR:\n")
+
+def test_types_of_nested_expressions_are_inferred_once(tmp_path, monkeypatch):
+    chain = 'x'
+    for i in range(12):
+        chain = f"({chain} {'+-*'[i % 3]} x)"
+    path = tmp_path / 'chain.sn'
+    path.write_text(f"function f(x: X) on (type X) -> X {{\n    return {chain}\n}}\n\n"
+                    f"function main() {{\n    print f(2), f(2.5)\n}}\n")
+
+    calls = []
+    get_type = nodes.BaseExpressionNode.get_type
+    def counted_get_type(self, expected_type=None):
+        calls.append(self)
+        return get_type(self, expected_type=expected_type)
+    monkeypatch.setattr(nodes.BaseExpressionNode, 'get_type', counted_get_type)
+
+    code = compile_file(path)
+    assert 'int64_t sn_f(int64_t const& sn_x)' in code and 'double sn_f(double const& sn_x)' in code
+    # Without the cache, the number of calls grows exponentially with the depth of the expression
+    assert len(calls) < 200
+
+def test_generic_functions_are_instantiated_once_per_combination_of_types(tmp_path, capsys):
+    path = tmp_path / 'generic.sn'
+    path.write_text("function show(a: X, b: X) on (type X) {\n    print a, b\n}\n\n"
+                    "function main() {\n    run show(1, 2)\n    run show(\"a\", \"b\")\n    run show(3, 4)\n}\n")
+    code = compile.main(parsing.parse_file(path), include_path=tmp_path, options=compile.CompileOptions(report_instantiations=True))
+    assert code.count('void sn_show(') == 4      # Declarations and definitions
+    assert 'show                                           2\nTotal: 2 instantiations of 1 generic functions\n' in capsys.readouterr().err
+
+    # The limit only applies to the compilation that it is set for
+    def compile_with_limit(limit):
+        return compile.main(parsing.parse_file(path), include_path=tmp_path, options=compile.CompileOptions(max_instantiations=limit))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        limited = executor.submit(compile_with_limit, 1)
+        unlimited = executor.submit(compile_with_limit, None)
+    assert unlimited.result() == code
+    with pytest.raises(SereneCompileError) as exc_info:
+        limited.result()
+    assert exc_info.value.message == "Generic function 'show' is instantiated with more than 1 combinations of types at line number 7."
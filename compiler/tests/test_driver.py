@@ -0,0 +1,126 @@
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from src import driver, parsing, build, pgo
+from src.build import BuildConfig
+from src.cache import DiskCache
+from src.driver import SereneBuildError
+
+tests_dir = Path(__file__).parent.resolve()
+
+
+@pytest.fixture(autouse=True)
+def python_parser(monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+
+@pytest.fixture
+def binary_cache(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / 'binaries', driver.binary_cache.max_size)
+    monkeypatch.setattr(driver, 'binary_cache', cache)
+    return cache
+
+def hello(text):
+    return driver.compile_to_cpp(tests_dir / 't1.sn').to_code().replace('Hello world!', text)
+
+def test_batch_reports_each_file(tmp_path):
+    invalid = tmp_path / 'invalid.sn'
+    invalid.write_text("function main() {\n    print 1;\n}\n")
+    paths = [tests_dir / 't1.sn', invalid, tests_dir / 'p3.sn', tests_dir / 't2.sn']
+
+    results = driver.run_batch(paths, output_dir=None)
+    assert [x.source_path for x in results] == paths
+    assert [x.exit_code for x in results] == [0, 1, 1, 0]
+    assert "Statements are terminated with newline characters" in results[1].message
+    assert "No 'main()' function is defined." in results[2].message
+
+def test_batch_builds_executables(tmp_path):
+    results = driver.run_batch([tests_dir / 't1.sn', tests_dir / 't31.sn'], output_dir=tmp_path)
+    assert [x.output_path for x in results] == [tmp_path / 't1', tmp_path / 't31']
+    assert all(x.output_path.is_file() for x in results)
+
+def test_inputs_are_expanded_and_deduplicated():
+    paths = driver.expand_inputs([str(tests_dir / 't1.sn'), str(tests_dir / 't?.sn')])
+    assert paths[0] == tests_dir / 't1.sn'
+    assert len(paths) == 9
+
+    with pytest.raises(SereneBuildError):
+        driver.expand_inputs([str(tests_dir / 'nonexistent.sn')])
+
+def test_output_names_must_be_unique(tmp_path):
+    with pytest.raises(SereneBuildError):
+        driver.batch_output_paths([tests_dir / 't1.sn', tests_dir / 'modules' / 't1.sn'], tmp_path)
+
+def test_builds_can_run_at_the_same_time(tmp_path, binary_cache):
+    texts = ['first', 'second', 'third']
+    with ThreadPoolExecutor(len(texts)) as executor:
+        paths = list(executor.map(lambda x: driver.build_executable(hello(x), tmp_path / x), texts))
+    for text, path in zip(texts, paths):
+        assert subprocess.run([path], capture_output=True, text=True).stdout == text + '\n'
+
+def test_unchanged_code_is_not_rebuilt(tmp_path, binary_cache, monkeypatch):
+    driver.build_executable(hello('cached'), tmp_path / 'a')
+    assert len(list(binary_cache.directory.iterdir())) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError('g++ was run')
+    with monkeypatch.context() as m:
+        m.setattr(subprocess, 'run', fail)
+        output_path = driver.build_executable(hello('cached'), tmp_path / 'b')
+    assert subprocess.run([output_path], capture_output=True, text=True).stdout == 'cached\n'
+
+    # Different flags produce a different executable
+    driver.build_executable(hello('cached'), tmp_path / 'c', BuildConfig('debug', '1'))
+    assert len(list(binary_cache.directory.iterdir())) == 2
+
+def test_large_programs_are_split_into_units(tmp_path, binary_cache, monkeypatch):
+    monkeypatch.setattr(build, 'min_unit_size', 1)
+    monkeypatch.setattr(driver, 'object_cache', DiskCache(tmp_path / 'objects', driver.object_cache.max_size, '.o'))
+    program = driver.compile_to_cpp(tests_dir / 't48.sn')
+    single = driver.build_executable(program, tmp_path / 'single', BuildConfig('debug', '0', jobs=1))     # Not cached with the same flags
+    split = driver.build_executable(program, tmp_path / 'split', BuildConfig(jobs=3))
+    assert len(program.to_units(3, 'generated.hh')) > 1
+    assert len(list(driver.object_cache.directory.iterdir())) == len(program.to_units(3, 'generated.hh'))
+    assert subprocess.run([split], capture_output=True).stdout == subprocess.run([single], capture_output=True).stdout
+
+    # After a function is edited, only its own unit is compiled again
+    program.functions[0] = program.functions[0].replace('int64_t{5}', 'int64_t{6}')
+    driver.build_executable(program, tmp_path / 'edited', BuildConfig(jobs=3))
+    assert len(list(driver.object_cache.directory.iterdir())) == len(program.to_units(3, 'generated.hh')) + 1
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_pgo_profile_is_reused(tmp_path, binary_cache, monkeypatch, jobs):
+    monkeypatch.setattr(pgo, 'profile_dir', tmp_path / 'pgo')
+    monkeypatch.setattr(build, 'min_unit_size', 1)
+    program = driver.compile_to_cpp(tests_dir / 't48.sn')
+    trained = driver.build_executable(program, tmp_path / 'trained', BuildConfig('release', jobs=jobs, pgo_command='{binary} > /dev/null'))
+    [key] = [x.name for x in pgo.profile_dir.iterdir()]
+    assert len(pgo.saved_profile(key)) == min(jobs, 2)
+
+    # Later builds of the same code with the same flags use the profile data, even without the binary cache. (g++ fails
+    # if the profile data doesn't match the code.)
+    monkeypatch.setattr(driver, 'use_binary_cache', False)
+    reused = driver.build_executable(program, tmp_path / 'reused', BuildConfig('release', jobs=jobs))
+    assert reused.read_bytes() == trained.read_bytes()
+
+def test_pgo_training_failure(tmp_path, binary_cache, monkeypatch):
+    monkeypatch.setattr(pgo, 'profile_dir', tmp_path / 'pgo')
+    with pytest.raises(SereneBuildError, match='training command failed'):
+        driver.build_executable(hello('x'), tmp_path / 'a', BuildConfig('release', pgo_command='{binary} > /dev/null; exit 3'))
+
+def test_includes_are_parsed_during_main_file(tmp_path, binary_cache, monkeypatch):
+    calls = []
+    parse_source = parsing.parse_source
+    def record(path):
+        calls.append((path, threading.current_thread() is threading.main_thread()))
+        return parse_source(path)
+    monkeypatch.setattr(parsing, 'parse_source', record)
+
+    driver.build_file(tests_dir / 't31.sn', tmp_path / 't31')
+    # Each file is parsed once, and the included file on another thread
+    assert sorted(calls) == [(tests_dir / 'modules' / 'lightbulbs.sn', False), (tests_dir / 't31.sn', True)]
+    assert parsing.prefetched == {}
+    assert (tmp_path / 't31').is_file()
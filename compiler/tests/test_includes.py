@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from src import compile, parsing
+from src.common import Symbol, SereneCompileError
+from src.nodes import Node
+
+
+def include(name):
+    return {'include_statement': [{'file_name': name}]}
+
+def function(name):
+    return {'function': [{'identifier': name}]}
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    # Maps file names to their definitions, and replaces the parser with a lookup in this dict
+    files = {}
+    calls = []
+    lock = threading.Lock()
+
+    def parse_file(path):
+        with lock:
+            calls.append(path.name)
+        return Node.create({'definitions': list(files[path.name])})
+
+    def write(name, definitions):
+        files[name] = definitions
+        (tmp_path / name).write_text('')
+
+    monkeypatch.setattr(parsing, 'parse_file', parse_file)
+    monkeypatch.setattr(parsing, 'max_workers', 4)
+    return write, calls
+
+def test_each_file_is_parsed_once_in_breadth_first_order(tmp_path, files):
+    write, calls = files
+    write('a.sn', [include('c.sn'), include('b.sn'), function('fa')])
+    write('b.sn', [include('a.sn'), function('fb')])
+    write('c.sn', [function('fc'), include('main.sn')])
+
+    tree = Node.create({'definitions': [include('a.sn'), include('b.sn'), function('main'), include('./a.sn')]})
+    compile.resolve_includes(tree, tmp_path, tmp_path / 'main.sn')
+
+    assert [x[Symbol.identifier].data for x in tree] == ['main', 'fa', 'fb', 'fc']
+    assert sorted(calls) == ['a.sn', 'b.sn', 'c.sn']
+
+def test_missing_include_is_an_error(tmp_path, files):
+    write, _ = files
+    write('a.sn', [include('missing.sn')])
+
+    with pytest.raises(SereneCompileError, match="Included file missing.sn does not exist."):
+        compile.resolve_includes(Node.create({'definitions': [include('a.sn')]}), tmp_path, tmp_path / 'main.sn')
@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+
+from src import compile, driver, incremental, parsing
+from src.cache import DiskCache
+from src.common import SereneError
+
+program = """\
+function main() {
+    print triple(3)
+    print half(3.0)
+    print twice(5)
+}
+
+function triple(x: Int64) -> Int64 {
+    return x * 3
+}
+
+function half(x: Float64) -> Float64 {
+    return x / 2.0
+}
+
+function twice(x: X) on (type X) -> X {
+    return x + x
+}
+"""
+
+
+struct_program = """\
+type Point struct {
+    x: Int64,
+    y: Int64
+}
+
+function origin() -> Point {
+    return Point(0, 0)
+}
+
+function main() {
+    var p = origin()
+    print p.x
+}
+"""
+
+
+two_callers_program = """\
+function a() {
+    print twice(1)
+}
+
+function b() {
+    print twice(2)
+}
+
+function main() {
+    run a()
+    run b()
+}
+
+function twice(x: X) on (type X) -> X {
+    return x + x
+}
+"""
+
+
+@pytest.fixture(autouse=True)
+def codegen_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+    monkeypatch.setattr(incremental, 'codegen_cache', DiskCache(tmp_path / 'codegen', incremental.codegen_cache.max_size, '.json'))
+    monkeypatch.setattr(incremental, 'memo', None)
+    return incremental.codegen_cache
+
+@pytest.fixture
+def memo(monkeypatch):
+    # Only the in-memory memo of watch mode
+    monkeypatch.setattr(incremental, 'use_cache', False)
+    monkeypatch.setattr(incremental, 'memo', incremental.CodegenMemo())
+    return incremental.memo
+
+def counts():
+    stats = incremental.latest_stats()
+    return stats.hits, stats.misses
+
+def compile_text(tmp_path, text):
+    path = tmp_path / 'program.sn'
+    path.write_text(text)
+    return compile.main(parsing.parse_file(path), include_path=tmp_path, source_path=path)
+
+def compile_fresh(tmp_path, text, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(incremental, 'memo', None)
+        m.setattr(incremental, 'use_cache', False)
+        return compile_text(tmp_path, text)
+
+def test_unchanged_program_is_not_generated_again(tmp_path, memo):
+    first = compile_text(tmp_path, program)
+    assert counts() == (0, 4)      # Three functions and one instantiation of 'twice'
+    # Adding lines moves every function, but line numbers don't affect the generated code
+    assert compile_text(tmp_path, '\n\n' + program) == first
+    assert counts() == (4, 0)
+
+def test_edited_body_only_regenerates_its_function(tmp_path, memo, monkeypatch):
+    compile_text(tmp_path, program)
+    edited = program.replace('return x * 3', 'return x * 4')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (3, 1)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+
+def test_edited_signature_regenerates_callers(tmp_path, memo, monkeypatch):
+    compile_text(tmp_path, program)
+    edited = program.replace('half(x: Float64)', 'half(x: Float64, y: Float64)').replace('x / 2.0', 'x / y').replace('half(3.0)', 'half(3.0, 2.0)')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (2, 2)      # half and main
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+
+def test_instantiations_are_requested_by_memoized_callers(tmp_path, memo, monkeypatch):
+    compile_text(tmp_path, program)
+    # main is memoized, but the instantiation of 'twice' that it requested is still generated
+    edited = program.replace('return x + x', 'return x + x + x')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (3, 1)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+    assert 'sn_twice(int64_t const& sn_x)' in code
+
+def test_instantiations_are_requested_by_every_caller(tmp_path, memo, monkeypatch):
+    compile_text(tmp_path, two_callers_program)
+    # a is the first to call twice(Int64), but b still requests it when a no longer does
+    edited = two_callers_program.replace('print twice(1)', 'print 1')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (3, 1)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+    assert 'sn_twice(int64_t const& sn_x)' in code
+
+def test_cache_is_kept_between_processes(tmp_path, codegen_cache, monkeypatch):
+    first = compile_text(tmp_path, program)
+    assert len(list(codegen_cache.directory.iterdir())) == 4
+    assert compile_text(tmp_path, program) == first
+    assert counts() == (4, 0)
+
+    edited = program.replace('return x * 3', 'return x * 4')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (3, 1)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+
+    # A different version of the compiler doesn't use the same entries
+    monkeypatch.setattr(incremental, 'compiler_hash', 'f' * 64)
+    code = compile_text(tmp_path, edited)
+    assert counts() == (0, 4)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+
+    compile_text(tmp_path, two_callers_program)
+    edited = two_callers_program.replace('print twice(1)', 'print 1')
+    code = compile_text(tmp_path, edited)
+    assert counts() == (3, 1)
+    assert code == compile_fresh(tmp_path, edited, monkeypatch)
+
+def test_structs_are_followed_through_signatures(tmp_path):
+    compile_text(tmp_path, struct_program)
+    assert counts() == (0, 3)
+    compile_text(tmp_path, struct_program.replace('    y: Int64', '    z: Int64'))
+    assert counts() == (0, 3)      # main only refers to Point through the signature of origin
+
+    # So main is checked again when the field that it uses is removed
+    with pytest.raises(SereneError):
+        compile_text(tmp_path, struct_program.replace('    x: Int64', '    w: Int64'))
+
+def test_watch_rebuilds_changed_files(tmp_path, memo, monkeypatch):
+    monkeypatch.setattr(driver, 'binary_cache', DiskCache(tmp_path / 'binaries', driver.binary_cache.max_size))
+    monkeypatch.setattr(parsing, 'tree_memo', None)
+    (tmp_path / 'module.sn').write_text("function helper() -> Int64 {\n    return 1\n}\n")
+    path = tmp_path / 'program.sn'
+    path.write_text("include module.sn\n\nfunction main() {\n    print helper()\n}\n")
+
+    parsed = []
+    parse_with_python = parsing.parse_with_python
+    def record(source_path, parse):
+        parsed.append(source_path.name)
+        return parse_with_python(source_path, parse)
+    monkeypatch.setattr(parsing, 'parse_with_python', record)
+
+    def edit():
+        while len(parsed) < 2:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        path.write_text("include module.sn\n\nfunction main() {\n    print helper() + 1\n}\n")
+    thread = threading.Thread(target=edit)
+    thread.start()
+    driver.watch(path, tmp_path / 'program', poll_interval=0.01, max_builds=2)
+    thread.join()
+
+    # The included file is only parsed once
+    assert sorted(parsed) == ['module.sn', 'program.sn', 'program.sn']
+    assert counts() == (1, 1)
+
+def test_cache_is_evicted_after_compiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, 'codegen_cache', DiskCache(tmp_path / 'codegen', 1, '.json'))
+    evictions = []
+    evict = incremental.codegen_cache.evict
+    monkeypatch.setattr(incremental.codegen_cache, 'evict', lambda: (evictions.append(None), evict()))
+    compile_text(tmp_path, program)
+    # Once for the whole compilation, rather than after each of the four entries
+    assert len(evictions) == 1
+    assert list(incremental.codegen_cache.directory.iterdir()) == []
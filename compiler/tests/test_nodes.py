@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+
+from src import compile, incremental, parser
+from src.common import Symbol
+from src.nodes import Node, NodeMap
+
+
+def make_map(*symbols):
+    return NodeMap([{x.name: str(i)} for i, x in enumerate(symbols)])
+
+def test_children_are_found_by_symbol():
+    children = make_map(Symbol.line_number, Symbol.term, Symbol.infix_op, Symbol.term)
+    assert children[Symbol.term].data == '1'      # The first child with the symbol
+    assert children[2].data == '2'
+    assert Symbol.infix_op in children
+    assert Symbol.expression not in children
+    assert (children.count(Symbol.term), children.count(Symbol.infix_op), children.count(Symbol.expression)) == (2, 1, 0)
+    with pytest.raises(IndexError):
+        children[Symbol.expression]
+
+def test_nodes_are_looked_up_through_their_children():
+    node = Node.create({'expression': [{'term': 'a'}, {'infix_op': '+'}, {'term': 'b'}]})
+    assert node.get_scalar(Symbol.infix_op) == '+'
+    assert node.count(Symbol.term) == 2
+    assert [x.data for x in node] == ['a', '+', 'b']
+    assert not hasattr(node[Symbol.infix_op], '__dict__')
+
+def test_same_children_share_an_index():
+    assert make_map(Symbol.term, Symbol.term).positions is make_map(Symbol.term, Symbol.term).positions
+    assert make_map(Symbol.term).positions is not make_map(Symbol.term, Symbol.term).positions
+    large = [Symbol.statement] * 20
+    assert make_map(*large).positions == {Symbol.statement: tuple(range(20))}
+
+def test_deeply_nested_trees_are_built_without_recursion():
+    depth = 10_000
+    tree = {'term': 'x'}
+    for _ in range(depth):
+        tree = {'expression': [{'term': [{'base_expression': [tree]}]}]}
+
+    node = Node.create(tree)
+    for _ in range(depth):
+        assert type(node).__name__ == 'ExpressionNode'
+        node = node[Symbol.term][Symbol.base_expression][0]
+    assert (node.nodetype, node.data) == (Symbol.term, 'x')
+
+def test_children_that_are_already_nodes_are_kept():
+    child = Node.make('identifier', 'a')
+    node = Node.create({'function': [child, {'identifier': 'b'}]})
+    assert node[0] is child
+    assert node[1].data == 'b'
+    with pytest.raises(KeyError):
+        Node.create({'not_a_symbol': 'a'})
+
+def test_nodes_of_compiled_programs_have_no_dict(monkeypatch):
+    # Including the subclasses, after code generation has set their attributes
+    monkeypatch.setattr(incremental, 'use_cache', False)
+    path = Path(__file__).parent / 't29.sn'
+    tree = parser.parse_nodes(path.read_text())
+    compile.main(tree, include_path=path.parent, source_path=path)
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        assert not hasattr(node, '__dict__'), type(node).__name__
+        if isinstance(node.data, NodeMap):
+            stack.extend(node.data.data)
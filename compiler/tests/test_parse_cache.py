@@ -0,0 +1,51 @@
+import json
+import os
+
+from src import parsing
+from src.cache import DiskCache
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache(tmp_path, max_size=350, suffix='.json')
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, b'x' * 100)
+        os.utime(cache.path_for(key), (i, i))
+
+    # Reading 'a' makes it the most recently used entry, so 'b' is evicted instead
+    assert cache.get('a') == b'x' * 100
+    cache.put('d', b'y' * 100)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.json', 'c.json', 'd.json']
+
+def test_cache_hit_skips_parser(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, 'parse_cache', DiskCache(tmp_path / 'cache', max_size=1024 * 1024, suffix='.json'))
+    monkeypatch.setattr(parsing, 'use_cache', True)
+    source_path = tmp_path / 'program.sn'
+    source_path.write_text("function main() {\n    print 1\n}\n")
+
+    tree = [{'definitions': [{'function': [{'identifier': 'main'}]}]}]
+    calls = []
+    def parse_text(path):
+        calls.append(path)
+        return json.dumps(tree)
+    monkeypatch.setattr(parsing, 'parse_text', parse_text)
+
+    assert parsing.parse_with_raku(source_path) == tree[0]
+    assert parsing.parse_with_raku(source_path) == tree[0]
+    assert len(calls) == 1
+
+    # Changing the file changes the key
+    source_path.write_text("function main() {\n    print 2\n}\n")
+    parsing.parse_with_raku(source_path)
+    assert len(calls) == 2
+
+def test_cache_is_evicted_once_per_compilation(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, 'parse_cache', DiskCache(tmp_path / 'cache', max_size=0, suffix='.json'))
+    monkeypatch.setattr(parsing, 'use_cache', True)
+    monkeypatch.setattr(parsing, 'parse_text', lambda path: '[{"definitions": null}]')
+    for name in ('a.sn', 'b.sn'):
+        (tmp_path / name).write_text(name)
+        parsing.parse_with_raku(tmp_path / name)
+    assert len(list(parsing.parse_cache.directory.iterdir())) == 2
+
+    parsing.finish()
+    assert list(parsing.parse_cache.directory.iterdir()) == []
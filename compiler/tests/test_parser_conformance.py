@@ -0,0 +1,30 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src import parser, parsing
+from src.common import SereneSyntaxError
+
+tests_dir = Path(__file__).parent.resolve()
+source_files = sorted(tests_dir.glob('*.sn')) + sorted(tests_dir.glob('modules/*.sn'))
+ids = [str(path.relative_to(tests_dir)) for path in source_files]
+
+
+def parse_python(path):
+    try:
+        return True, parser.parse(path.read_text(encoding='utf-8'))
+    except SereneSyntaxError as exc:
+        return False, exc.message
+
+@pytest.mark.skipif(shutil.which('raku') is None, reason="Raku is not installed")
+@pytest.mark.parametrize('path', source_files, ids=ids)
+def test_same_tree_as_raku_parser(path):
+    try:
+        expected = (True, json.loads(parsing.parse_once(path))[0])
+    except SereneSyntaxError as exc:
+        expected = (False, exc.message.rstrip('\n'))
+
+    success, result = parse_python(path)
+    assert (success, result if success else result.rstrip('\n')) == expected
@@ -0,0 +1,53 @@
+import shutil
+import time
+
+import pytest
+
+from src import parsing
+from src.common import Symbol
+
+
+def generate_program(n_lines):
+    # Each function is 5 lines long, and every line contains a statement or a comment
+    functions = []
+    for i in range(n_lines // 5):
+        functions.append(f"function f{i}(x: Int) -> Int {{\n"
+                         f"    // Comment {i}\n"
+                         f"    var y = x + {i}\n"
+                         f"    return y\n"
+                         f"}}\n")
+    return ''.join(functions)
+
+def time_parse(path):
+    start = time.perf_counter()
+    tree = parsing.parse_file(path)
+    return time.perf_counter() - start, tree
+
+@pytest.mark.parametrize('backend', [
+    pytest.param('raku', marks=pytest.mark.skipif(shutil.which('raku') is None, reason="Raku is not installed")),
+    'python',
+])
+def test_parse_time_is_linear(tmp_path, monkeypatch, backend):
+    monkeypatch.setattr(parsing, 'backend', backend)
+    monkeypatch.setattr(parsing, 'use_server', False)
+    monkeypatch.setattr(parsing, 'use_cache', False)
+
+    empty_path = tmp_path / 'empty.sn'
+    empty_path.write_text(generate_program(5))
+    small_path = tmp_path / 'small.sn'
+    small_path.write_text(generate_program(12_500))
+    large_path = tmp_path / 'large.sn'
+    large_path.write_text(generate_program(50_000))
+
+    # Subtract the time it takes to start Rakudo and compile the grammar, if the Raku parser is used
+    startup, _ = time_parse(empty_path)
+    small, _ = time_parse(small_path)
+    large, tree = time_parse(large_path)
+
+    assert len(tree.data) == 10_000
+    last_statement = tree.data[-1][Symbol.statements].data[-1]
+    assert last_statement[Symbol.line_number].data == 49_999
+
+    # Quadrupling the file size should take about 4 times as long, while a quadratic parser would take about 16 times as long
+    ratio = (large - startup) / max(small - startup, 1e-3)
+    assert ratio < 8, f"Parsing 4x as many lines took {ratio:.1f}x as long"
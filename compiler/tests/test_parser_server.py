@@ -0,0 +1,80 @@
+import subprocess
+import sys
+
+import pytest
+
+from src import parsing
+
+# Stand-ins for 'raku src/parser.raku --server --json', which speak the same protocol. The first responds to every
+# request, with an error for files that contain 'error', and the second exits as soon as it receives a request.
+responding_server = """\
+import sys
+for line in sys.stdin:
+    text = open(line.rstrip('\\n')).read()
+    status, body = ('ERR', 'COMPILE ERROR:\\nInvalid program.\\n') if 'error' in text else ('OK', '[{"definitions": null}]')
+    body = body.encode('utf-8')
+    sys.stdout.buffer.write(f"{status} {len(body)}\\n".encode('utf-8') + body)
+    sys.stdout.buffer.flush()
+"""
+
+crashing_server = """\
+import sys
+sys.stdin.readline()
+sys.exit(1)
+"""
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    # Each time a server is started, the next of the scripts in the returned list is run instead of the Raku parser
+    scripts = []
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, '-c', scripts.pop(0)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    monkeypatch.setattr(parsing.ParserServer, 'start', start)
+    monkeypatch.setattr(parsing, 'servers', parsing.ParserServerPool())
+    monkeypatch.setattr(parsing, 'use_server', True)
+    yield scripts
+    parsing.servers.stop()
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'program.sn'
+    path.write_text("function main() {\n    print 1\n}\n")
+    return path
+
+def test_responses_are_read_from_the_server(tmp_path, servers, program):
+    servers.append(responding_server)
+    invalid = tmp_path / 'invalid.sn'
+    invalid.write_text("error\n")
+
+    assert parsing.servers.parse(program) == (True, '[{"definitions": null}]')
+    assert parsing.servers.parse(invalid) == (False, 'COMPILE ERROR:\nInvalid program.\n')
+    assert parsing.parse_text(program) == '[{"definitions": null}]'
+    # The same server is used for every request
+    assert len(parsing.servers.servers) == 1
+
+def test_crashed_server_is_restarted_once(servers, program):
+    servers.extend([crashing_server, responding_server])
+    assert parsing.parse_text(program) == '[{"definitions": null}]'
+    assert servers == []
+    assert parsing.use_server
+
+def test_parser_falls_back_to_one_shot_parsing(servers, program, monkeypatch, capsys):
+    servers.extend([crashing_server, crashing_server])
+    monkeypatch.setattr(parsing, 'parse_once', lambda source_path: 'parsed once')
+
+    assert parsing.parse_text(program) == 'parsed once'
+    assert "Parser server crashed. Falling back to one-shot parsing." in capsys.readouterr().err
+    # Later files are parsed the same way, without starting another server
+    assert not parsing.use_server
+    assert parsing.parse_text(program) == 'parsed once'
+
+def test_missing_raku_falls_back_to_one_shot_parsing(tmp_path, servers, program, monkeypatch, capsys):
+    def start(self):
+        self.process = subprocess.Popen([str(tmp_path / 'raku'), 'src/parser.raku', '--server', '--json'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    monkeypatch.setattr(parsing.ParserServer, 'start', start)
+    monkeypatch.setattr(parsing, 'parse_once', lambda source_path: 'parsed once')
+
+    assert parsing.parse_text(program) == 'parsed once'
+    assert "Parser server crashed. Falling back to one-shot parsing." in capsys.readouterr().err
+    assert not parsing.use_server
@@ -0,0 +1,27 @@
+import pstats
+import re
+from pathlib import Path
+
+from src import driver, parsing, profiling
+
+tests_dir = Path(__file__).parent.resolve()
+
+
+def test_profile_files_are_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+    monkeypatch.setattr(profiling, 'output_dir', tmp_path)
+
+    driver.compile_to_cpp(tests_dir / 't40.sn')
+
+    stats = pstats.Stats(str(tmp_path / 't40.pstats'))
+    assert any(function == 'generate_code' for _, _, function in stats.stats)
+
+    # Each line of a collapsed stack file is "frame;frame;...;frame count"
+    for line in (tmp_path / 't40.collapsed').read_text().splitlines():
+        assert re.fullmatch(r'[^;]+(;[^;]+)* \d+', line)
+
+def test_profiling_is_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+    monkeypatch.chdir(tmp_path)
+    driver.compile_to_cpp(tests_dir / 't1.sn')
+    assert list(tmp_path.iterdir()) == []
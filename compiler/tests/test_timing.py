@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from src import compile, parsing, timing
+
+tests_dir = Path(__file__).parent.resolve()
+
+
+def test_phases_functions_and_instantiations_are_timed(monkeypatch):
+    monkeypatch.setattr(parsing, 'backend', 'python')
+    path = tests_dir / 't40.sn'
+
+    timer = timing.PhaseTimer()
+    with timing.use_timer(timer):
+        compile.main(parsing.parse_file(path), include_path=path.parent, source_path=path)
+
+    report = timer.to_json()
+    phases = [x['name'] for x in report['phase']]
+    assert phases[0] == 'parse (Python parser)'
+    assert 'FunctionNode.setup' in phases and 'generic instantiation' in phases
+    assert [x['name'] for x in report['function']] == ['main']
+    assert 'multiplyAndPrint(Float32, Float32)' in [x['name'] for x in report['generic']]
+    assert all(x['count'] >= 1 and x['wall'] >= 0 for category in timing.categories for x in report[category])
+
+def test_no_timer_is_a_no_op():
+    assert timing.current_timer() is None
+    with timing.phase('anything'):
+        pass
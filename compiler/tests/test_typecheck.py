@@ -0,0 +1,22 @@
+import copy
+import pickle
+
+import pytest
+
+from src.typecheck import TypeObject
+
+
+def test_same_types_are_the_same_object():
+    vector = TypeObject('Vector', [TypeObject('Int64')])
+    assert vector is TypeObject('Vector', params=(TypeObject('Int64'),))
+    assert vector.params == (TypeObject('Int64'),)
+    assert vector != TypeObject('Vector', [TypeObject('Float64')])
+    assert TypeObject('Int64') != None
+    assert {vector: 1}[TypeObject('Vector', [TypeObject('Int64')])] == 1
+
+def test_types_are_immutable():
+    int_type = TypeObject('Int64')
+    with pytest.raises(AttributeError):
+        int_type.base = 'Float64'
+    assert copy.deepcopy(int_type) is int_type
+    assert pickle.loads(pickle.dumps(TypeObject('Array', [int_type]))) is TypeObject('Array', [int_type])